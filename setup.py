@@ -5,7 +5,7 @@ install_requires = [
     'six>=1.7.2',
     'python-dateutil>=2.2',
     'requests>=2.3.0',
-    'htmlmin>=0.1.5',
+    'htmlmin>=0.1.12',
     'pytz>=2014.4',
     'beautifulsoup4>=4.3.2',
     'storysniffer>=0.0.3',
@@ -31,8 +31,12 @@ setup(
     zip_safe=False,
     scripts=(
         'bin/storytracker-archive',
+        'bin/storytracker-daemon',
         'bin/storytracker-get',
         'bin/storytracker-links2csv',
+        'bin/storytracker-manifest',
+        'bin/storytracker-pack',
+        'bin/storytracker-train-dictionary',
     ),
     install_requires=install_requires,
 )
@@ -1,14 +1,43 @@
 from .archive import archive
+from .archive import archive_many
 from .analysis import ArchivedURL
 from .analysis import ArchivedURLSet
+from .analysis import BodyCache
 from .analysis import Hyperlink
+from .analysis import HyperlinkTable
 from .analysis import Image
+from .analysis import LazyArchivedURL
+from .analysis import StreamingSummary
+from .cache import ValidatorCache
+from .compression import Codec
+from .compression import detect_codec
+from .compression import get_codec
+from .compression import register_codec
 from .exceptions import ArchiveFileNameError
+from .exceptions import CircuitOpenError
+from .exceptions import NotModifiedError
+from .fetcher import CircuitBreaker
+from .fetcher import Fetcher
+from .fetcher import get_default_fetcher
+from .fetcher import HostRateLimiter
 from .files import create_archive_filename
+from .files import iter_archive_directory
 from .files import open_archive_directory
 from .files import open_archive_filepath
 from .files import reverse_archive_filename
+from .files import reverse_archive_filenames
+from .pack import ArchivePack
+from .pack import open_archive_pack
+from .pack import pack_directory
+from .manifest import Manifest
+from .stories import classify_hrefs
+from .stories import get_default_classifier
+from .stories import set_default_classifier
+from .stories import StoryClassifier
+from .sketches import HyperLogLog
+from .sketches import TDigest
 from .get import get
+from .get import get_many
 from .pastpages import open_pastpages_url
 from .waybackmachine import open_wayback_machine_url
 from .waybackmachine import reverse_wayback_machine_url
@@ -16,17 +45,46 @@ from .waybackmachine import reverse_wayback_machine_url
 
 __all__ = [
     'archive',
+    'archive_many',
     'ArchivedURL',
     'ArchivedURLSet',
+    'ArchivePack',
     'ArchiveFileNameError',
+    'BodyCache',
+    'CircuitBreaker',
+    'CircuitOpenError',
+    'classify_hrefs',
+    'Codec',
     'create_archive_filename',
+    'detect_codec',
+    'Fetcher',
     'get',
+    'get_codec',
+    'get_default_classifier',
+    'get_default_fetcher',
+    'get_many',
+    'HostRateLimiter',
+    'HyperLogLog',
     'Hyperlink',
+    'HyperlinkTable',
     'Image',
+    'iter_archive_directory',
+    'LazyArchivedURL',
+    'Manifest',
+    'NotModifiedError',
     'open_archive_directory',
     'open_archive_filepath',
+    'open_archive_pack',
     'open_pastpages_url',
     'open_wayback_machine_url',
+    'pack_directory',
+    'register_codec',
     'reverse_archive_filename',
+    'reverse_archive_filenames',
     'reverse_wayback_machine_url',
+    'set_default_classifier',
+    'StoryClassifier',
+    'StreamingSummary',
+    'TDigest',
+    'ValidatorCache',
 ]
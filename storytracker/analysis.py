@@ -1,30 +1,39 @@
 import os
 import six
 import math
-import copy
+import array
 import gzip
 import base64
 import shutil
 import socket
 import logging
 import tempfile
+import threading
 import calculate
 import images2gif
 import collections
 import storytracker
-import storysniffer
 from six import BytesIO
 from datetime import timedelta
 from selenium import webdriver
 from PIL import Image as PILImage
 from PIL import ImageFont as PILImageFont
 from PIL import ImageDraw as PILImageDraw
-from .toolbox import UnicodeMixin, indent
+from .cache import DigestCache
+from .compression import get_codec
+from .manifest import record_archive
+from .sketches import HyperLogLog, TDigest
+from .stories import classify_hrefs, get_default_classifier
+from .toolbox import RunningMedian, UnicodeMixin, indent
 from jinja2 import Environment, PackageLoader
 if six.PY2:
     import unicodecsv as csv
 else:
     import csv
+try:
+    import numpy
+except ImportError:
+    numpy = None
 try:
     from urlparse import urlparse
 except ImportError:
@@ -40,32 +49,41 @@ class ArchivedURL(UnicodeMixin):
     """
     def __init__(
         self,
-        url, timestamp, html,
+        url, timestamp, html=None,
         html_archive_path=None,
         gzip_archive_path=None,
+        compressed_archive_path=None,
+        delta_archive_path=None,
         browser_width=1366,
         browser_height=768,
         browser_driver="PhantomJS",
         browser_timeout=45,
+        content=None,
+        encoding="utf-8",
     ):
         self.url = url
         self.timestamp = timestamp
-        self.html = html
+        # The HTML can be provided as text, or as undecoded bytes
+        # that will only be decoded if the text is needed
+        self._html = html
+        self._content = content
+        self.encoding = encoding
+        self._digest = None
         # Attributes that come in handy below
         self.html_archive_path = html_archive_path
         self.gzip_archive_path = gzip_archive_path
+        self.compressed_archive_path = compressed_archive_path
+        self.delta_archive_path = delta_archive_path
         self._browser = None
         self._height = None
         self._width = None
         self._hyperlinks = []
+        self._hyperlink_table = None
         self._images = []
         self._summary_statistics = {}
         self._screenshot = None
         self.this_directory = os.path.dirname(os.path.realpath(__file__))
-        self.font = PILImageFont.truetype(
-            os.path.join(self.this_directory, "fonts/OpenSans-Regular.ttf"),
-            35
-        )
+        self._font = None
         # Configuration for our web browser
         self.browser_width = browser_width
         self.browser_height = browser_height
@@ -80,7 +98,7 @@ class ArchivedURL(UnicodeMixin):
             return NotImplemented
         if self.url == other.url:
             if self.timestamp == other.timestamp:
-                if self.html == other.html:
+                if self.digest == other.digest:
                     return True
         return False
 
@@ -109,15 +127,96 @@ class ArchivedURL(UnicodeMixin):
         """
         return storytracker.create_archive_filename(self.url, self.timestamp)
 
+    def get_font(self):
+        # Only load the font when it is needed to draw something
+        if self._font is None:
+            path = os.path.join(
+                self.this_directory,
+                "fonts/OpenSans-Regular.ttf"
+            )
+            self._font = PILImageFont.truetype(path, 35)
+        return self._font
+
+    def set_font(self, font):
+        self._font = font
+    font = property(get_font, set_font)
+
+    def get_content(self):
+        """
+        Returns the archived HTML as undecoded bytes, if there are any.
+        """
+        return self._content
+
+    def get_html(self):
+        """
+        Returns the archived HTML as text, decoding it if necessary.
+        """
+        if self._html is None:
+            content = self.get_content()
+            if content is not None:
+                self._html = content.decode(self.encoding, "replace")
+        return self._html
+
+    def set_html(self, html):
+        self._html = html
+        self._content = None
+        self._digest = None
+        self.encoding = "utf-8"
+    html = property(get_html, set_html)
+
+    @property
+    def digest(self):
+        """
+        Returns a hex digest of the archived HTML, which is only worked out
+        the first time it is asked for.
+        """
+        if self._digest is None:
+            self._digest = DigestCache.digest(self.encoded_html)
+        return self._digest
+
+    @property
+    def fingerprint(self):
+        """
+        Returns a tuple of the URL, timestamp and HTML digest that
+        identifies this snapshot.
+        """
+        return (self.url, self.timestamp, self.digest)
+
+    @property
+    def encoded_html(self):
+        """
+        Returns the archived HTML as UTF-8 bytes.
+
+        Undecoded bytes already in UTF-8 are passed through untouched.
+        """
+        if self.encoding in ("utf-8", "ascii"):
+            content = self.get_content()
+            if content is not None:
+                return content
+        return self.html.encode("utf-8")
+
+    @property
+    def archive_path(self):
+        """
+        Returns the path to the file where this archive was last saved
+        """
+        return self.gzip_archive_path or \
+            self.compressed_archive_path or \
+            self.delta_archive_path or \
+            self.html_archive_path
+
     @property
     def gzip(self):
         """
         Returns HTML as a stream of gzipped data
         """
-        out = BytesIO()
-        with gzip.GzipFile(fileobj=out, mode="wb") as f:
-            f.write(self.html.encode("utf-8"))
-        return out.getvalue()
+        return self.compress()
+
+    def compress(self, codec="gzip", level=None):
+        """
+        Returns HTML compressed with the named codec
+        """
+        return get_codec(codec).compress(self.encoded_html, level=level)
 
     def get_browser(self, force=False):
         """
@@ -238,11 +337,19 @@ class ArchivedURL(UnicodeMixin):
         # If we already have the list, return it
         if self._hyperlinks and not force:
             return self._hyperlinks
+        # If they have been moved into a table, read them from there
+        if self._hyperlink_table is not None and not force:
+            return list(self._hyperlink_table)
+
+        # Stuff that list in our cache and then pass it out
+        self._hyperlinks = list(self._iter_hyperlinks())
+        return self._hyperlinks
+    hyperlinks = property(get_hyperlinks)
 
+    def _iter_hyperlinks(self):
         # Loop through all <a> tags with href attributes
         # and convert them to Hyperlink objects
         logger.debug("Extracting hyperlinks from HTML")
-        obj_list = []
         link_list = self.browser.find_elements_by_tag_name("a")
         for i, a in enumerate(link_list):
             href = a.get_attribute("href")
@@ -285,19 +392,33 @@ class ArchivedURL(UnicodeMixin):
                 cell=self.get_cell(alocation['x'], alocation['y']),
                 font_size=a.value_of_css_property("font-size"),
             )
-            # Add to the link list
-            obj_list.append(hyperlink_obj)
+            yield hyperlink_obj
 
-        # Stuff that list in our cache and then pass it out
-        self._hyperlinks = obj_list
-        return obj_list
-    hyperlinks = property(get_hyperlinks)
+    def get_hyperlink_table(self, force=False):
+        """
+        Returns the hyperlinks from the HTML as a HyperlinkTable.
+
+        The table is cached after it is first accessed. It takes the place
+        of the list of Hyperlink objects, which are served up as views into
+        the table from then on.
+        """
+        if self._hyperlink_table is None or force:
+            if self._hyperlinks and not force:
+                hyperlinks = self._hyperlinks
+            else:
+                hyperlinks = self._iter_hyperlinks()
+            self._hyperlink_table = HyperlinkTable(hyperlinks)
+            self._hyperlinks = []
+        return self._hyperlink_table
+    hyperlink_table = property(get_hyperlink_table)
 
     def get_story_links(self):
         """
         Return only hyperlinks estimated to be stories.
         """
-        return [h for h in self.hyperlinks if h.is_story]
+        hyperlinks = self.hyperlinks
+        flags = classify_hrefs([h.href for h in hyperlinks])
+        return [h for h, is_story in zip(hyperlinks, flags) if is_story]
     story_links = property(get_story_links)
 
     def get_hyperlink_by_href(self, href, fails_silently=True):
@@ -307,7 +428,7 @@ class ArchivedURL(UnicodeMixin):
         """
         # If hyperlinks have already been harvested, just loop through
         # those and see if you find a match.
-        if self._hyperlinks:
+        if self._hyperlinks or self._hyperlink_table is not None:
             for this_hyperlink in self.hyperlinks:
                 if this_hyperlink.href == href:
                     return this_hyperlink
@@ -424,7 +545,7 @@ class ArchivedURL(UnicodeMixin):
 
         If there is a tie, returns the one that appears first on the page.
         """
-        story_hyperlinks = [h for h in self.hyperlinks if h.is_story]
+        story_hyperlinks = self.get_story_links()
         try:
             return sorted(
                 story_hyperlinks,
@@ -456,9 +577,7 @@ class ArchivedURL(UnicodeMixin):
         self._summary_statistics = {
             'hyperlink_count': len(self.hyperlinks),
             'image_count': len(self.images),
-            'story_link_count': len([
-                h for h in self.hyperlinks if h.is_story
-            ])
+            'story_link_count': len(self.get_story_links())
         }
 
         # Pass it back out
@@ -582,7 +701,7 @@ class ArchivedURL(UnicodeMixin):
         Writes gzipped HTML data to provided file object.
         """
         with gzip.GzipFile(fileobj=file, mode="wb") as f:
-            f.write(self.html.encode("utf-8"))
+            f.write(self.encoded_html)
 
     def write_gzip_to_directory(self, path):
         """
@@ -594,8 +713,9 @@ class ArchivedURL(UnicodeMixin):
             path,
             "%s.gz" % self.archive_filename
         )
-        fileobj = open(self.gzip_archive_path, 'wb')
-        self.write_gzip_to_file(fileobj)
+        with open(self.gzip_archive_path, 'wb') as fileobj:
+            self.write_gzip_to_file(fileobj)
+        record_archive(self, self.gzip_archive_path)
         return self.gzip_archive_path
 
     def write_gzip_to_path(self, path):
@@ -605,6 +725,41 @@ class ArchivedURL(UnicodeMixin):
         fileobj = open(path, 'wb')
         self.write_gzip_to_file(fileobj)
 
+    def write_compressed_to_file(self, file, codec="gzip", level=None):
+        """
+        Writes HTML data compressed with the named codec to the provided
+        file object.
+        """
+        file.write(self.compress(codec, level=level))
+
+    def write_compressed_to_directory(self, path, codec="gzip", level=None):
+        """
+        Writes HTML data compressed with the named codec to a file in the
+        provided directory path
+        """
+        if not os.path.isdir(path):
+            raise ValueError("Path must be a directory")
+        codec = get_codec(codec)
+        archive_path = os.path.join(
+            path,
+            "%s%s" % (self.archive_filename, codec.extension)
+        )
+        with open(archive_path, 'wb') as f:
+            f.write(codec.compress(self.encoded_html, level=level))
+        # Gzip files keep to the attribute they have always used
+        if codec.name == "gzip":
+            self.gzip_archive_path = archive_path
+        else:
+            self.compressed_archive_path = archive_path
+        record_archive(self, archive_path)
+        return archive_path
+
+    def write_to_pack(self, pack):
+        """
+        Appends HTML data to the provided ArchivePack
+        """
+        return pack.append(self)
+
     def write_html_to_directory(self, path):
         """
         Writes HTML data to a file in the provided directory path
@@ -616,6 +771,7 @@ class ArchivedURL(UnicodeMixin):
             "%s.html" % self.archive_filename
         )
         self.write_html_to_path(self.html_archive_path)
+        record_archive(self, self.html_archive_path)
         return self.html_archive_path
 
     def write_html_to_path(self, path):
@@ -623,7 +779,7 @@ class ArchivedURL(UnicodeMixin):
         Writes HTML data to the provided path.
         """
         with open(path, 'wb') as f:
-            f.write(self.html.encode("utf-8"))
+            f.write(self.encoded_html)
 
     def timestamp_image(self, image, width=460, height=50):
         textlayer = PILImage.new(
@@ -891,14 +1047,274 @@ class ArchivedURL(UnicodeMixin):
         im.save(path, 'PNG')
 
 
+class StreamingSummary(object):
+    """
+    Summary statistics about archived URLs that are added one at a time.
+
+    Unlike ArchivedURLSet, nothing is held onto once each archived URL
+    has been counted, so any number of them can be summarized in the
+    same amount of memory. Counts and positions are kept in TDigest
+    sketches and distinct hrefs in HyperLogLog sketches, which means the
+    medians and distinct counts are close estimates rather than exact.
+    Averages, minimums and maximums are exact.
+    """
+    def __init__(self, compression=100, precision=14):
+        self.archived_url_count = 0
+        self.earliest_timestamp = None
+        self.latest_timestamp = None
+        self.hyperlink_counts = TDigest(compression)
+        self.story_link_counts = TDigest(compression)
+        self.image_counts = TDigest(compression)
+        self.hyperlink_y = TDigest(compression)
+        self.story_link_y = TDigest(compression)
+        self.hrefs = HyperLogLog(precision)
+        self.story_hrefs = HyperLogLog(precision)
+
+    def __repr__(self):
+        return '<StreamingSummary: %s archived URLs>' % (
+            self.archived_url_count
+        )
+
+    def add(self, obj):
+        """
+        Counts the provided ArchivedURL object.
+        """
+        hyperlinks = obj.hyperlinks
+        images = obj.images
+        obj.close_browser()
+        flags = classify_hrefs([h.href for h in hyperlinks])
+
+        self.archived_url_count += 1
+        if self.earliest_timestamp is None or \
+                obj.timestamp < self.earliest_timestamp:
+            self.earliest_timestamp = obj.timestamp
+        if self.latest_timestamp is None or \
+                obj.timestamp > self.latest_timestamp:
+            self.latest_timestamp = obj.timestamp
+        self.hyperlink_counts.add(len(hyperlinks))
+        self.story_link_counts.add(len([f for f in flags if f]))
+        self.image_counts.add(len(images))
+        for h, is_story in zip(hyperlinks, flags):
+            self.hrefs.add(h.href or '')
+            if h.y is not None:
+                self.hyperlink_y.add(h.y)
+            if is_story:
+                self.story_hrefs.add(h.href)
+                if h.y is not None:
+                    self.story_link_y.add(h.y)
+
+    def extend(self, obj_list):
+        """
+        Counts every ArchivedURL object in the provided iterable, which
+        can be a generator like ``iter_archive_directory``.
+        """
+        for obj in obj_list:
+            self.add(obj)
+
+    def get_summary_statistics(self):
+        """
+        Returns a dictionary of summary statistics about every archived
+        URL counted so far.
+        """
+        stats = {
+            'archived_url_count': self.archived_url_count,
+            'earliest_timestamp': self.earliest_timestamp,
+            'latest_timestamp': self.latest_timestamp,
+            'distinct_href_count': self.hrefs.count(),
+            'distinct_story_href_count': self.story_hrefs.count(),
+        }
+        for name, digest in [
+            ('hyperlink_count', self.hyperlink_counts),
+            ('story_link_count', self.story_link_counts),
+            ('image_count', self.image_counts),
+            ('hyperlink_y', self.hyperlink_y),
+            ('story_link_y', self.story_link_y),
+        ]:
+            stats['%s_average' % name] = digest.mean
+            stats['%s_median' % name] = digest.median
+            stats['%s_min' % name] = digest.min
+            stats['%s_max' % name] = digest.max
+            if digest.count:
+                stats['%s_range' % name] = digest.max - digest.min
+            else:
+                stats['%s_range' % name] = None
+        return stats
+    summary_statistics = property(get_summary_statistics)
+
+
+class HrefStatistics(object):
+    """
+    Running totals that describe where an href has appeared across a
+    set of archived URLs.
+
+    Every figure is updated as each appearance is added, so a set can
+    take in a new snapshot without going back over the old ones.
+    """
+    def __init__(self, href):
+        self.href = href
+        self.is_story = None
+        self.count = 0
+        self.earliest_timestamp = None
+        self.latest_timestamp = None
+        self.headline_list = []
+        self._headlines = set()
+        self.minimum_y = None
+        self.maximum_y = None
+        self._sum_y = 0.0
+        self._median_y = RunningMedian()
+
+    def add(self, url, hyperlink):
+        """
+        Counts an appearance of the href as the provided Hyperlink on the
+        provided ArchivedURL.
+        """
+        if not self.count:
+            self.is_story = hyperlink.is_story
+            self.earliest_timestamp = self.latest_timestamp = url.timestamp
+            self.minimum_y = self.maximum_y = hyperlink.y
+        else:
+            self.earliest_timestamp = min(
+                self.earliest_timestamp,
+                url.timestamp
+            )
+            self.latest_timestamp = max(self.latest_timestamp, url.timestamp)
+            self.minimum_y = min(self.minimum_y, hyperlink.y)
+            self.maximum_y = max(self.maximum_y, hyperlink.y)
+        self.count += 1
+        if hyperlink.string not in self._headlines:
+            self._headlines.add(hyperlink.string)
+            self.headline_list.append(hyperlink.string)
+        self._sum_y += float(hyperlink.y)
+        self._median_y.add(hyperlink.y)
+
+    def get_statistics(self, archived_url_count):
+        """
+        Returns a dictionary of the statistics, in the form returned by
+        ArchivedURLSet.get_hyperlinks.
+        """
+        if self.count > 1:
+            range_y = float(self.maximum_y) - float(self.minimum_y)
+            average_y = self._sum_y / self.count
+            median_y = self._median_y.median
+        else:
+            range_y, average_y, median_y = None, None, None
+        return dict(
+            href=self.href,
+            is_story=self.is_story,
+            archived_url_count=archived_url_count,
+            archived_urls_with_href=self.count,
+            earliest_timestamp=self.earliest_timestamp,
+            latest_timestamp=self.latest_timestamp,
+            timedelta=self.latest_timestamp - self.earliest_timestamp,
+            headline_list=list(self.headline_list),
+            maximum_y=self.maximum_y,
+            minimum_y=self.minimum_y,
+            range_y=range_y,
+            average_y=average_y,
+            median_y=median_y,
+        )
+
+
+class BodyCache(object):
+    """
+    A bounded cache of the HTML loaded by LazyArchivedURL objects.
+
+    Holds the bytes, and the text once it is decoded, for up to
+    ``max_size`` pages, throwing out the least recently used first.
+    """
+    def __init__(self, max_size=100):
+        self.max_size = max_size
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._cache:
+                return None
+            body = self._cache.pop(key)
+            self._cache[key] = body
+            return body
+
+    def set(self, key, body):
+        with self._lock:
+            self._cache.pop(key, None)
+            self._cache[key] = body
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+class LazyArchivedURL(ArchivedURL):
+    """
+    An ArchivedURL that only reads its HTML when it is needed.
+
+    ``loader`` is a function that returns the undecoded bytes. If a
+    BodyCache is provided, the HTML is kept there rather than on the
+    object, so only that many pages are held in memory at once no matter
+    how many objects there are. Otherwise it is kept on the object once
+    it is loaded.
+    """
+    def __init__(
+        self, url, timestamp, loader, cache=None, cache_key=None, **kwargs
+    ):
+        super(LazyArchivedURL, self).__init__(url, timestamp, **kwargs)
+        self.loader = loader
+        self.cache = cache
+        self._cache_key = cache_key
+        self._loaded = False
+
+    @property
+    def cache_key(self):
+        return self._cache_key or self.archive_path or \
+            (self.url, self.timestamp.isoformat())
+
+    def _get_body(self):
+        body = self.cache.get(self.cache_key)
+        if body is None:
+            body = {"content": self.loader(), "html": None}
+            self.cache.set(self.cache_key, body)
+        return body
+
+    def get_content(self):
+        if self._loaded:
+            return self._content
+        if self.cache is not None:
+            return self._get_body()['content']
+        self._content = self.loader()
+        self._loaded = True
+        return self._content
+
+    def get_html(self):
+        if self._loaded or self.cache is None:
+            return super(LazyArchivedURL, self).get_html()
+        body = self._get_body()
+        if body['html'] is None:
+            body['html'] = body['content'].decode(self.encoding, "replace")
+        return body['html']
+
+    def set_html(self, html):
+        super(LazyArchivedURL, self).set_html(html)
+        self._loaded = True
+    html = property(get_html, set_html)
+
+
 class ArchivedURLSet(collections.MutableSequence):
     """
     A list of archived URLs
     """
     def __init__(self, object_list):
         self._list = list()
+        # Objects filed by URL and timestamp, so duplicates can be found
+        # without comparing the HTML of everything in the list
+        self._index = {}
+        self._reset_hyperlinks()
         [self.append(o) for o in object_list]
-        self._hyperlinks = list()
 
     def __len__(self):
         """List length"""
@@ -910,11 +1326,44 @@ class ArchivedURLSet(collections.MutableSequence):
 
     def __delitem__(self, ii):
         """Delete an item"""
+        if isinstance(ii, slice):
+            removed = self._list[ii]
+        else:
+            removed = [self._list[ii]]
         del self._list[ii]
+        [self._unindex(o) for o in removed]
+        self._reset_hyperlinks()
 
     def __setitem__(self, ii, val):
-        self._acl_check(val)
-        return self._list[ii]
+        """Replace an item"""
+        old = self._list[ii]
+        self._unindex(old)
+        try:
+            self._url_check(val)
+        except (TypeError, ValueError):
+            self._index_obj(old)
+            raise
+        self._list[ii] = val
+        self._index_obj(val)
+        self._reset_hyperlinks()
+
+    def __contains__(self, obj):
+        if not isinstance(obj, ArchivedURL):
+            return False
+        matches = self._index.get((obj.url, obj.timestamp), [])
+        # Only read the HTML if there's another snapshot from the same time
+        return any(o.digest == obj.digest for o in matches)
+
+    def _index_obj(self, obj):
+        self._index.setdefault((obj.url, obj.timestamp), []).append(obj)
+
+    def _unindex(self, obj):
+        key = (obj.url, obj.timestamp)
+        matches = [o for o in self._index.get(key, []) if o is not obj]
+        if matches:
+            self._index[key] = matches
+        else:
+            self._index.pop(key, None)
 
     def _url_check(self, obj):
         # Verify that the user is trying to add an ArchivedURL object
@@ -922,16 +1371,27 @@ class ArchivedURLSet(collections.MutableSequence):
             raise TypeError("Only ArchivedURL objects can be added")
 
         # Check if the object is already in the list
-        if obj in [o for o in list(self.__iter__())]:
+        if obj in self:
             raise ValueError("This object is already in the list")
 
     def insert(self, ii, obj):
         self._url_check(obj)
         self._list.insert(ii, obj)
+        self._index_obj(obj)
+        self._pending.append(obj)
 
     def append(self, obj):
         self._url_check(obj)
-        self._list.append(copy.copy(obj))
+        self._list.append(obj)
+        self._index_obj(obj)
+        self._pending.append(obj)
+
+    def _reset_hyperlinks(self):
+        # Throw out the hyperlink analysis so it is redone from scratch
+        self._hyperlinks = list()
+        self._href_index = None
+        self._href_statistics = None
+        self._pending = list()
 
     def uniquify(self, seq):
         keys = {}
@@ -957,78 +1417,58 @@ class ArchivedURLSet(collections.MutableSequence):
         of statistics attached that describe how they are
         positioned.
         """
-        # If we already have the list, return it
-        if self._hyperlinks and not force:
+        # If we already have the list and nothing has been added, return it
+        if self._hyperlinks and not force and not self._pending:
             return self._hyperlinks
 
-        # Analyze hyperlinks for all of the URLs in the set
-        [obj.analyze(force=False) for obj in self]
+        # Analyze and count the URLs that haven't been counted yet
+        self.get_href_index(force=force)
 
-        # Create a list of all the unique href attributes
-        all_hrefs = []
-        for url in self:
-            all_hrefs.extend([a.href for a in url.hyperlinks])
-        unique_hrefs = self.uniquify(all_hrefs)
-
-        # Loop through them all and run the numbers
-        analyzed_list = []
-        for href in unique_hrefs:
-            # Find all the times it occurs
-            url_hits, a_hits = [], []
-            for url in self:
-                this_a = url.get_hyperlink_by_href(href)
-                if this_a:
-                    url_hits.append(url)
-                    a_hits.append(this_a)
-
-            # Some basic stats
-            archived_url_count = len(self)
-            archived_urls_with_href = len(url_hits)
-
-            # The earliest timestamp the link appeared
-            earliest_timestamp = min([url.timestamp for url in url_hits])
-
-            # The last timestamp the link appeared
-            latest_timestamp = max([url.timestamp for url in url_hits])
-
-            # The time delta between those two times
-            timedelta = latest_timestamp - earliest_timestamp
-
-            # Headlines
-            headline_list = self.uniquify([a.string for a in a_hits])
-
-            # Vertical position on the page
-            y_list = [a.y for a in a_hits]
-            maximum_y = max(y_list)
-            minimum_y = min(y_list)
-            if len(y_list) > 1:
-                range_y = calculate.range(y_list)
-                average_y = calculate.mean(y_list)
-                median_y = calculate.median(y_list)
-            else:
-                range_y, average_y, median_y = None, None, None
-
-            # Stuff it in the dict and pass it out
-            d = dict(
-                href=href,
-                is_story=a_hits[0].is_story,
-                archived_url_count=archived_url_count,
-                archived_urls_with_href=archived_urls_with_href,
-                earliest_timestamp=earliest_timestamp,
-                latest_timestamp=latest_timestamp,
-                timedelta=timedelta,
-                headline_list=headline_list,
-                maximum_y=maximum_y,
-                minimum_y=minimum_y,
-                range_y=range_y,
-                average_y=average_y,
-                median_y=median_y,
-            )
-            analyzed_list.append(d)
-        self._hyperlinks = analyzed_list
-        return analyzed_list
+        # Pull the numbers for each href out of its running totals
+        archived_url_count = len(self)
+        self._hyperlinks = [
+            s.get_statistics(archived_url_count)
+            for s in self._href_statistics.values()
+        ]
+        return self._hyperlinks
     hyperlinks = property(get_hyperlinks)
 
+    def get_href_index(self, force=False):
+        """
+        Returns an ordered dictionary that maps every href in the set to a
+        list of (ArchivedURL, Hyperlink) pairs, one for each archived URL
+        it appears in, in the order they were added to the set.
+
+        Like ``get_hyperlink_by_href``, only the first hyperlink with the
+        href on each page is included.
+
+        The index is built in a single pass and cached after it is first
+        accessed. URLs added to the set later are folded in the next time
+        it is asked for. Set the `force` kwarg to True to rebuild it.
+        """
+        if force or self._href_index is None:
+            self._href_index = collections.OrderedDict()
+            self._href_statistics = collections.OrderedDict()
+            self._pending = list(self)
+
+        if self._pending:
+            # The statistics have to be pulled out of the totals again
+            self._hyperlinks = list()
+        for url in self._pending:
+            url.analyze(force=False)
+            seen = set()
+            for a in url.hyperlinks:
+                if a.href in seen:
+                    continue
+                seen.add(a.href)
+                self._href_index.setdefault(a.href, []).append((url, a))
+                if a.href not in self._href_statistics:
+                    self._href_statistics[a.href] = HrefStatistics(a.href)
+                self._href_statistics[a.href].add(url, a)
+        self._pending = list()
+        return self._href_index
+    href_index = property(get_href_index)
+
     @property
     def summary_statistics(self):
         """
@@ -1487,6 +1927,12 @@ class Hyperlink(UnicodeMixin):
     """
     A hyperlink extracted from an archived URL.
     """
+    # Pages have hundreds of links, so skip a __dict__ for each one
+    __slots__ = (
+        "href", "string", "index", "_domain", "images",
+        "width", "height", "x", "y", "cell", "font_size",
+    )
+
     def __init__(
         self, href, string, index, images=[],
         x=None, y=None,
@@ -1496,10 +1942,7 @@ class Hyperlink(UnicodeMixin):
         self.href = href
         self.string = string
         self.index = index
-        try:
-            self.domain = urlparse(href).netloc
-        except:
-            self.domain = ''
+        self._domain = None
         self.images = images
         self.width = width
         self.height = height
@@ -1533,6 +1976,26 @@ class Hyperlink(UnicodeMixin):
         else:
             return six.text_type(self.href)
 
+    def get_domain(self):
+        # Only parse the URL when someone asks
+        if self._domain is None:
+            try:
+                self._domain = urlparse(self.href).netloc
+            except:
+                self._domain = ''
+        return self._domain
+
+    def set_domain(self, domain):
+        self._domain = domain
+    domain = property(get_domain, set_domain)
+
+    @property
+    def font_size_px(self):
+        """
+        The font size as a number of pixels, or None if it can't be read.
+        """
+        return parse_font_size(self.font_size)
+
     def __csv__(self):
         """
         Returns a list of values ready to be written to a CSV file object
@@ -1577,10 +2040,7 @@ class Hyperlink(UnicodeMixin):
         Returns a true or false estimate of whether the URL links to a news
         story.
         """
-        try:
-            return storysniffer.guess(self.href)
-        except (ValueError, TypeError):
-            return False
+        return get_default_classifier().classify(self.href)
 
     @property
     def area(self):
@@ -1596,6 +2056,8 @@ class Image(UnicodeMixin):
     """
     An image extracted from an archived URL.
     """
+    __slots__ = ("src", "width", "height", "x", "y", "cell")
+
     def __init__(
         self, src, width=None, height=None, x=None, y=None, cell=None
     ):
@@ -1668,3 +2130,155 @@ class Image(UnicodeMixin):
             return 'landscape'
         elif self.height > self.width:
             return 'portrait'
+
+
+class HyperlinkTable(object):
+    """
+    The hyperlinks extracted from an archived URL, stored a column at a
+    time rather than as one object per link.
+
+    The position, size and font size in pixels of every link are kept in
+    arrays of floats, with NaN where a value is missing. They are NumPy
+    arrays if NumPy is installed, so whole columns can be worked on at
+    once, and standard library arrays if it is not. The href, domain,
+    text, cell and font size of every link are kept as codes into a list
+    of their distinct values, so repeated strings are only stored once.
+
+    Indexing or iterating over the table returns HyperlinkView objects
+    that work like Hyperlink objects.
+    """
+    NUMBER_COLUMNS = ("index", "x", "y", "width", "height", "font_size_px")
+    STRING_COLUMNS = ("href", "domain", "string", "cell", "font_size")
+
+    def __init__(self, hyperlinks):
+        # Fill every column in a single pass, so the hyperlinks can come
+        # from a generator without all being held in memory at once
+        numbers = dict((name, []) for name in self.NUMBER_COLUMNS)
+        strings = dict(
+            (name, ([], {}, [])) for name in self.STRING_COLUMNS
+        )
+        self._images = []
+        for h in hyperlinks:
+            for name, values in numbers.items():
+                values.append(getattr(h, name))
+            for name, (distinct, lookup, codes) in strings.items():
+                value = getattr(h, name)
+                if value not in lookup:
+                    lookup[value] = len(distinct)
+                    distinct.append(value)
+                codes.append(lookup[value])
+            self._images.append(h.images)
+        self._numbers = dict(
+            (name, _float_array(values)) for name, values in numbers.items()
+        )
+        self._strings = dict(
+            (name, (distinct, _int_array(codes)))
+            for name, (distinct, lookup, codes) in strings.items()
+        )
+
+    def __len__(self):
+        return len(self._images)
+
+    def __getitem__(self, ii):
+        if ii < 0:
+            ii += len(self)
+        if not 0 <= ii < len(self):
+            raise IndexError("Hyperlink index out of range")
+        return HyperlinkView(self, ii)
+
+    def __iter__(self):
+        for ii in range(len(self)):
+            yield HyperlinkView(self, ii)
+
+    def __repr__(self):
+        return '<HyperlinkTable: %s hyperlinks>' % len(self)
+
+    def column(self, name):
+        """
+        Returns the array of numbers, or the list of strings, stored in
+        the named column.
+        """
+        if name in self._numbers:
+            return self._numbers[name]
+        if name in self._strings:
+            distinct, codes = self._strings[name]
+            return [distinct[c] for c in codes]
+        raise KeyError("%s is not a column" % name)
+
+    def get_number(self, name, ii):
+        value = float(self._numbers[name][ii])
+        if math.isnan(value):
+            return None
+        if value.is_integer():
+            return int(value)
+        return value
+
+    def get_string(self, name, ii):
+        distinct, codes = self._strings[name]
+        return distinct[codes[ii]]
+
+    def get_images(self, ii):
+        return self._images[ii]
+
+
+def _view_column(name, kind):
+    # Builds a read-only property that looks the value up in the table
+    if kind == "number":
+        return property(lambda self: self.table.get_number(name, self.row))
+    return property(lambda self: self.table.get_string(name, self.row))
+
+
+class HyperlinkView(Hyperlink):
+    """
+    A Hyperlink that reads its values from a row in a HyperlinkTable.
+    """
+    __slots__ = ("table", "row")
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    href = _view_column("href", "string")
+    domain = _view_column("domain", "string")
+    string = _view_column("string", "string")
+    cell = _view_column("cell", "string")
+    index = _view_column("index", "number")
+    x = _view_column("x", "number")
+    y = _view_column("y", "number")
+    width = _view_column("width", "number")
+    height = _view_column("height", "number")
+    font_size = _view_column("font_size", "string")
+    font_size_px = _view_column("font_size_px", "number")
+
+    @property
+    def images(self):
+        return self.table.get_images(self.row)
+
+
+def parse_font_size(font_size):
+    """
+    Returns the number of pixels in a CSS font size like "16px", or None
+    if it can't be read.
+    """
+    if font_size is None:
+        return None
+    font_size = six.text_type(font_size).strip()
+    if font_size.endswith("px"):
+        font_size = font_size[:-2]
+    try:
+        return float(font_size)
+    except ValueError:
+        return None
+
+
+def _float_array(values):
+    values = [float("nan") if v is None else float(v) for v in values]
+    if numpy is not None:
+        return numpy.array(values, dtype=numpy.float64)
+    return array.array("d", values)
+
+
+def _int_array(values):
+    if numpy is not None:
+        return numpy.array(values, dtype=numpy.int32)
+    return array.array("i", values)
@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import os
 import six
 import pytz
 import logging
@@ -6,6 +7,18 @@ import htmlmin
 import storytracker
 from datetime import datetime
 from bs4 import BeautifulSoup
+from htmlmin.parser import HTMLMinParser
+from six.moves.html_parser import HTMLParser
+from xml.sax.saxutils import quoteattr
+from .cache import DigestCache
+from .compression import get_codec
+from .delta import DeltaStore
+from .dictionaries import write_dictionary_compressed_to_directory
+from .exceptions import NotModifiedError
+from .fetcher import Fetcher
+from .get import detect_encoding, get_response
+from .manifest import record_archive
+from .toolbox import threaded_imap
 try:
     from urlparse import urljoin
 except ImportError:
@@ -29,42 +42,334 @@ COMMON_HYPERLINK_LOCATIONS = (
 )
 
 
+def extend_attrs(base_url, tag, attrs):
+    """
+    Accepts a tag name and its list of (name, value) attribute pairs and
+    returns the list with relative URLs in the same locations as
+    COMMON_HYPERLINK_LOCATIONS replaced by absolute ones.
+    """
+    if tag in ("img", "script"):
+        target = "src"
+    elif tag == "a":
+        target = "href"
+    elif tag == "link":
+        d = dict(attrs)
+        rel = (d.get("rel") or "").lower().split()
+        if "stylesheet" not in rel and d.get("type") != "text/css":
+            return attrs
+        target = "href"
+    else:
+        return attrs
+    return [
+        (k, urljoin(base_url, v) if k == target and v is not None else v)
+        for k, v in attrs
+    ]
+
+
+class URLExtendingMinParser(HTMLMinParser):
+    """
+    Minifies HTML and extends relative URLs in the same pass.
+    """
+    def __init__(self, base_url, **kwargs):
+        HTMLMinParser.__init__(self, **kwargs)
+        self.base_url = base_url
+
+    def handle_starttag(self, tag, attrs):
+        HTMLMinParser.handle_starttag(
+            self,
+            tag,
+            extend_attrs(self.base_url, tag, attrs)
+        )
+
+    def handle_startendtag(self, tag, attrs):
+        HTMLMinParser.handle_startendtag(
+            self,
+            tag,
+            extend_attrs(self.base_url, tag, attrs)
+        )
+
+
+class URLExtendingParser(HTMLParser):
+    """
+    Extends relative URLs while leaving the rest of the HTML untouched.
+    """
+    def __init__(self, base_url):
+        if six.PY3:
+            HTMLParser.__init__(self, convert_charrefs=False)
+        else:
+            HTMLParser.__init__(self)
+        self.base_url = base_url
+        self._data_buffer = []
+
+    @property
+    def result(self):
+        return ''.join(self._data_buffer)
+
+    def build_tag(self, tag, attrs, close_tag):
+        extended = extend_attrs(self.base_url, tag, attrs)
+        # If nothing changed, pass through the original markup
+        if extended == attrs:
+            return self.get_starttag_text()
+        bits = ["<", tag]
+        for k, v in extended:
+            if v is None:
+                bits.append(" %s" % k)
+            else:
+                bits.append(" %s=%s" % (k, quoteattr(v)))
+        bits.append(" />" if close_tag else ">")
+        return "".join(bits)
+
+    def handle_starttag(self, tag, attrs):
+        self._data_buffer.append(self.build_tag(tag, attrs, False))
+
+    def handle_startendtag(self, tag, attrs):
+        self._data_buffer.append(self.build_tag(tag, attrs, True))
+
+    def handle_endtag(self, tag):
+        self._data_buffer.append("</%s>" % tag)
+
+    def handle_data(self, data):
+        self._data_buffer.append(data)
+
+    def handle_entityref(self, name):
+        self._data_buffer.append("&%s;" % name)
+
+    def handle_charref(self, name):
+        self._data_buffer.append("&#%s;" % name)
+
+    def handle_comment(self, data):
+        self._data_buffer.append("<!--%s-->" % data)
+
+    def handle_decl(self, decl):
+        self._data_buffer.append("<!%s>" % decl)
+
+    def handle_pi(self, data):
+        self._data_buffer.append("<?%s>" % data)
+
+    def unknown_decl(self, data):
+        self._data_buffer.append("<![%s]>" % data)
+
+
+def rewrite_html(html, url, minify=True, extend_urls=True, engine="stream"):
+    """
+    Minifies the provided HTML and replaces relative URLs with
+    absolute URLs based on the URL it was retrieved from.
+
+    The default "stream" engine does the work in a single pass over the
+    document. The "soup" engine parses it into a BeautifulSoup tree instead.
+    """
+    if engine == "soup":
+        if minify:
+            html = htmlmin.minify(html)
+        if extend_urls:
+            soup = BeautifulSoup(html)
+            for target in COMMON_HYPERLINK_LOCATIONS:
+                for hit in soup.findAll(*target['tag']):
+                    hit[target['attr']] = urljoin(url, hit[target['attr']])
+            html = six.text_type(soup)
+        return html
+    elif engine != "stream":
+        raise ValueError("engine must be 'stream' or 'soup'")
+
+    if minify and extend_urls:
+        parser = URLExtendingMinParser(url)
+    elif minify:
+        parser = HTMLMinParser()
+    elif extend_urls:
+        parser = URLExtendingParser(url)
+    else:
+        return html
+    parser.feed(html)
+    parser.close()
+    return parser.result
+
+
 def archive(
     url, verify=True, minify=True, extend_urls=True, compress=True,
-    output_dir=None
+    output_dir=None, fetcher=None, validator_cache=None, unchanged="skip",
+    dedup=None, engine="stream", compress_level=None, delta=False,
+    keyframe_interval=10, dictionary=False, pack=None
         ):
     """
     Archive the HTML from the provided URL
     """
+    # Compression can be asked for by the name of a codec,
+    # or with True to get the gzip files we have always made
+    if compress is True:
+        compress = "gzip"
     logger.debug("Archiving URL: %s" % url)
 
     # Get the html
     now = datetime.utcnow()
     now = now.replace(tzinfo=pytz.utc)
-    html = storytracker.get(url, verify=verify)
+    try:
+        response = get_response(
+            url,
+            verify=verify,
+            fetcher=fetcher,
+            validator_cache=validator_cache
+        )
+    except NotModifiedError:
+        logger.debug("%s has not changed" % url)
+        # Leave an empty file behind to record the visit, if called for
+        if unchanged == "marker" and output_dir:
+            marker_path = os.path.join(
+                output_dir,
+                "%s.unchanged" % storytracker.create_archive_filename(url, now)
+            )
+            open(marker_path, "wb").close()
+        return None
+    content = response.content
+    encoding = detect_encoding(content, response.headers)
 
-    # Minify the html (but option to skip)
-    if minify:
-        html = htmlmin.minify(html)
+    # Minify the html and replace all relative URLs with absolute URLs,
+    # (but option to skip either) and create an URLArchive object
+    if minify or extend_urls:
+        html = rewrite_html(
+            content.decode(encoding, "replace"),
+            url,
+            minify=minify,
+            extend_urls=extend_urls,
+            engine=engine
+        )
+        obj = storytracker.ArchivedURL(url, now, html)
+    # If we're not changing anything, hold on to the bytes and only
+    # decode them if someone asks for the text
+    else:
+        obj = storytracker.ArchivedURL(
+            url,
+            now,
+            content=content,
+            encoding=encoding
+        )
 
-    # Replace all relative URLs with absolute URLs, if called for
-    if extend_urls:
-        soup = BeautifulSoup(html)
-        for target in COMMON_HYPERLINK_LOCATIONS:
-            for hit in soup.findAll(*target['tag']):
-                hit[target['attr']] = urljoin(url, hit[target['attr']])
-        html = six.text_type(soup)
+    # Check if we already have an identical copy, if called for
+    duplicate = None
+    if output_dir and dedup:
+        digests = DigestCache.for_directory(output_dir)
+        duplicate = digests.get_duplicate(url, obj.encoded_html)
+        if duplicate and dedup == "skip":
+            logger.debug("%s is identical to %s" % (url, duplicate))
+            if validator_cache:
+                validator_cache.update(url, response)
+            return None
 
-    # Create an URLArchive object
-    obj = storytracker.ArchivedURL(url, now, html)
+    # Add it to a pack, if one is provided
+    if pack is not None:
+        logger.debug("Adding to %s" % pack)
+        pack.append(obj)
 
     # If a custom output dir is provided put everything in there
     if output_dir:
-        logger.debug("Writing file to %s" % output_dir)
-        if compress:
-            obj.write_gzip_to_directory(output_dir)
+        if duplicate and link_duplicate(
+            obj,
+            duplicate,
+            output_dir,
+            compress=compress
+        ):
+            digests.update(url, obj.encoded_html, obj.archive_path)
         else:
-            obj.write_html_to_directory(output_dir)
+            logger.debug("Writing file to %s" % output_dir)
+            if delta:
+                DeltaStore.for_directory(output_dir).write(
+                    obj,
+                    keyframe_interval=keyframe_interval,
+                    compress=compress,
+                    compress_level=compress_level
+                )
+            elif dictionary:
+                write_dictionary_compressed_to_directory(
+                    obj,
+                    output_dir,
+                    level=compress_level
+                )
+            elif compress:
+                obj.write_compressed_to_directory(
+                    output_dir,
+                    codec=compress,
+                    level=compress_level
+                )
+            else:
+                obj.write_html_to_directory(output_dir)
+            if dedup:
+                digests.update(url, obj.encoded_html, obj.archive_path)
+
+    # Only remember the validators once the snapshot is saved, so a
+    # failed write means the page is downloaded again next time
+    if validator_cache:
+        validator_cache.update(url, response)
 
     # Return ArchivedURL object
     return obj
+
+
+def link_duplicate(obj, duplicate, output_dir, compress=True):
+    """
+    Hard links a new archive file for the provided ArchivedURL object
+    to an identical one that already exists.
+
+    Returns True if it worked. Returns False if the file has to be written
+    out normally instead.
+    """
+    if compress:
+        codec = get_codec("gzip" if compress is True else compress)
+        ext = codec.extension
+    else:
+        ext = ".html"
+    if not duplicate.endswith(ext):
+        return False
+    path = os.path.join(output_dir, "%s%s" % (obj.archive_filename, ext))
+    try:
+        os.link(duplicate, path)
+    except (OSError, AttributeError):
+        return False
+    if compress and codec.name == "gzip":
+        obj.gzip_archive_path = path
+    elif compress:
+        obj.compressed_archive_path = path
+    else:
+        obj.html_archive_path = path
+    record_archive(obj, path)
+    logger.debug("Linked %s to %s" % (path, duplicate))
+    return True
+
+
+def archive_many(
+    urls, concurrency=10, ordered=False, fails_silently=True, fetcher=None,
+    **kwargs
+        ):
+    """
+    Archive the HTML from many URLs at once.
+
+    Yields ArchivedURL objects as each one finishes. Accepts the same
+    keyword arguments as ``archive``.
+    """
+    # Share one set of pooled connections big enough for every worker
+    close_fetcher = False
+    if not fetcher:
+        fetcher = Fetcher(pool_maxsize=concurrency)
+        close_fetcher = True
+
+    def _archive(url):
+        return archive(url, fetcher=fetcher, **kwargs)
+
+    try:
+        for url, obj, exc_info in threaded_imap(
+            _archive,
+            urls,
+            workers=concurrency,
+            ordered=ordered
+        ):
+            if exc_info:
+                if not fails_silently:
+                    six.reraise(*exc_info)
+                logger.error(
+                    "Could not archive %s" % url,
+                    exc_info=exc_info
+                )
+                continue
+            if obj:
+                yield obj
+    finally:
+        if close_fetcher:
+            fetcher.close()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+import os
+import json
+import hashlib
+import threading
+
+
+class JSONStore(object):
+    """
+    A dictionary persisted to a JSON file on disk.
+
+    Safe to share between threads. Changes are written out with an atomic
+    rename so a crash never leaves a half-written file behind.
+    """
+    def __init__(self, path, autosave=True):
+        self.path = path
+        self.autosave = autosave
+        self._lock = threading.Lock()
+        self._data = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self._data = json.load(f)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+        if self.autosave:
+            self.save()
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+        if self.autosave:
+            self.save()
+
+    def save(self):
+        """
+        Writes the data out to disk.
+        """
+        with self._lock:
+            tmp_path = "%s.%s.tmp" % (
+                self.path,
+                threading.current_thread().ident
+            )
+            with open(tmp_path, "w") as f:
+                json.dump(self._data, f)
+            os.rename(tmp_path, self.path)
+
+
+class ValidatorCache(JSONStore):
+    """
+    Remembers the ETag and Last-Modified headers returned for each URL
+    so later requests can ask the server to skip pages that have not changed.
+    """
+    def get_headers(self, url):
+        """
+        Returns the conditional request headers to send for the provided URL.
+        """
+        validators = self.get(url) or {}
+        headers = {}
+        if validators.get("etag"):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get("last_modified"):
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    def update(self, url, response):
+        """
+        Records the validators from the provided response.
+        """
+        etag = response.headers.get("etag")
+        last_modified = response.headers.get("last-modified")
+        if etag or last_modified:
+            self.set(url, {"etag": etag, "last_modified": last_modified})
+        elif url in self:
+            self.delete(url)
+
+
+class DirectoryStore(JSONStore):
+    """
+    A JSONStore kept in a hidden file inside an archive directory.
+
+    Use ``for_directory`` so every caller working in the same directory
+    shares one instance. Subclasses set the ``filename``.
+    """
+    filename = None
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def for_directory(cls, path):
+        key = (cls, os.path.abspath(path))
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(os.path.join(key[1], cls.filename))
+            return cls._instances[key]
+
+    @property
+    def directory(self):
+        return os.path.dirname(self.path)
+
+
+class DigestCache(DirectoryStore):
+    """
+    Remembers a digest of the last HTML archived for each URL in a
+    directory, along with the path of the file it was written to.
+    """
+    filename = ".storytracker-digests.json"
+
+    @staticmethod
+    def digest(content):
+        """
+        Returns a hex digest of the provided bytes.
+        """
+        return hashlib.sha1(content).hexdigest()
+
+    def get_duplicate(self, url, content):
+        """
+        Returns the path to the last file archived for the provided URL if its
+        contents are identical to the provided bytes and it still exists.
+        """
+        last = self.get(url)
+        if not last or last['digest'] != self.digest(content):
+            return None
+        if not os.path.exists(last['path']):
+            return None
+        return last['path']
+
+    def update(self, url, content, path):
+        """
+        Records the bytes most recently archived for the provided URL.
+        """
+        self.set(url, {"digest": self.digest(content), "path": path})
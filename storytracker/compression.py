@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+import os
+import bz2
+import gzip
+import logging
+from six import BytesIO
+logger = logging.getLogger(__name__)
+
+
+class Codec(object):
+    """
+    A compression format that archive files can be written in.
+
+    ``extension`` is the file extension used for its files and ``magic``
+    the bytes its files start with, if it has any. ``default_level`` is
+    used when no compression level is asked for.
+    """
+    def __init__(
+        self, name, extension, compress, decompress, magic=None,
+        default_level=None
+    ):
+        self.name = name
+        self.extension = extension
+        self.magic = magic
+        self.default_level = default_level
+        self._compress = compress
+        self._decompress = decompress
+
+    def __repr__(self):
+        return '<Codec: %s>' % self.name
+
+    def compress(self, data, level=None):
+        """
+        Returns the provided bytes compressed.
+        """
+        if level is None:
+            level = self.default_level
+        return self._compress(data, level)
+
+    def decompress(self, data):
+        """
+        Returns the provided compressed bytes decompressed.
+        """
+        return self._decompress(data)
+
+
+# All of the codecs we know how to use, keyed by name
+CODECS = {}
+
+
+def register_codec(codec):
+    """
+    Adds a Codec to those available for reading and writing archives.
+    """
+    CODECS[codec.name] = codec
+    return codec
+
+
+def get_codec(name):
+    """
+    Returns the registered Codec with the provided name.
+    """
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(
+            "Compression codec %s is not available. Choose from %s" % (
+                name,
+                ", ".join(sorted(CODECS))
+            )
+        )
+
+
+def detect_codec(path=None, data=None):
+    """
+    Returns the Codec a file was written with, or None if it does not
+    look compressed.
+
+    The file extension of the provided path is checked first. If that
+    does not settle it, the first bytes of the provided data are checked
+    for a codec's magic number.
+    """
+    if path:
+        ext = os.path.splitext(path)[1]
+        for codec in CODECS.values():
+            if ext == codec.extension:
+                return codec
+    if data:
+        for codec in CODECS.values():
+            if codec.magic and data.startswith(codec.magic):
+                return codec
+    return None
+
+
+def _gzip_compress(data, level):
+    out = BytesIO()
+    with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=level) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def _gzip_decompress(data):
+    with gzip.GzipFile(fileobj=BytesIO(data), mode="rb") as f:
+        return f.read()
+
+
+register_codec(Codec(
+    "gzip",
+    ".gz",
+    _gzip_compress,
+    _gzip_decompress,
+    magic=b"\x1f\x8b",
+    default_level=9,
+))
+register_codec(Codec(
+    "bz2",
+    ".bz2",
+    lambda data, level: bz2.compress(data, level),
+    bz2.decompress,
+    magic=b"BZh",
+    default_level=9,
+))
+
+# The rest are only available if their libraries are installed
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+if lzma:
+    register_codec(Codec(
+        "xz",
+        ".xz",
+        lambda data, level: lzma.compress(data, preset=level),
+        lzma.decompress,
+        magic=b"\xfd7zXZ\x00",
+        default_level=6,
+    ))
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+if zstandard:
+    register_codec(Codec(
+        "zstd",
+        ".zst",
+        lambda data, level: zstandard.ZstdCompressor(
+            level=level
+        ).compress(data),
+        # Decompress in a stream since the frame may not record its size
+        lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(
+            data
+        ),
+        magic=b"\x28\xb5\x2f\xfd",
+        default_level=3,
+    ))
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+if brotli:
+    # Brotli streams have no magic number, so only the extension will do
+    register_codec(Codec(
+        "brotli",
+        ".br",
+        lambda data, level: brotli.compress(data, quality=level),
+        brotli.decompress,
+        default_level=11,
+    ))
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+import six
+import time
+import json
+import random
+import logging
+import threading
+import storytracker
+from .fetcher import CircuitBreaker, Fetcher, HostRateLimiter
+from .pack import ArchivePack
+from .toolbox import threaded_imap
+logger = logging.getLogger(__name__)
+
+
+class CaptureJob(object):
+    """
+    A URL to be archived over and over on a fixed interval.
+
+    An ``output_dir``, or a ``pack`` to add to, is required so the
+    captures are saved somewhere.
+    """
+    def __init__(self, url, interval=300, output_dir=None, **kwargs):
+        pack = kwargs.get("pack")
+        if pack is not None and not isinstance(pack, ArchivePack):
+            raise ValueError("pack must be an ArchivePack")
+        if not output_dir and pack is None:
+            raise ValueError("%s has no output_dir to save to" % url)
+        self.url = url
+        self.interval = float(interval)
+        self.output_dir = output_dir
+        self.archive_kwargs = kwargs
+        self.base_run = None
+        self.next_run = None
+        self.last_run = None
+
+    def __repr__(self):
+        return '<CaptureJob: %s every %ss>' % (self.url, self.interval)
+
+
+class Scheduler(object):
+    """
+    Archives a list of CaptureJob objects on their schedules.
+
+    Each job's first run is offset so that jobs sharing an interval are
+    spread evenly across it rather than all firing at once, and a random
+    jitter is added to every run. A single Fetcher is kept open the whole
+    time so connections stay warm between rounds.
+
+    If no Fetcher is provided, one is created using the
+    ``fetcher_options`` dictionary. The options in the ``rate_limit`` and
+    ``circuit_breaker`` dictionaries are used to create a HostRateLimiter
+    and a CircuitBreaker for it.
+    """
+    def __init__(
+        self, jobs, jitter=0.1, workers=4, fetcher=None, fetcher_options=None,
+        rate_limit=None, circuit_breaker=None
+    ):
+        self.jobs = list(jobs)
+        self.jitter = jitter
+        self.workers = workers
+        if not fetcher:
+            options = dict(fetcher_options or {})
+            options.setdefault("pool_maxsize", workers)
+            if rate_limit:
+                options['rate_limiter'] = HostRateLimiter(**rate_limit)
+            if circuit_breaker:
+                options['circuit_breaker'] = CircuitBreaker(**circuit_breaker)
+            fetcher = Fetcher(**options)
+        self.fetcher = fetcher
+        self._stop = threading.Event()
+        self.schedule()
+
+    @classmethod
+    def from_manifest(cls, path, **kwargs):
+        """
+        Creates a Scheduler from a JSON or YAML manifest file.
+
+        The manifest has a list of ``urls``, each either a string or a
+        dictionary of keyword arguments for CaptureJob, and an optional
+        dictionary of ``defaults`` applied to all of them. Other top-level
+        keys are passed to the Scheduler.
+
+        A ``pack`` is given as a path, and every job that names the same
+        path adds to the same ArchivePack.
+        """
+        with open(path, "r") as f:
+            if path.endswith((".yml", ".yaml")):
+                try:
+                    import yaml
+                except ImportError:
+                    raise ImportError("PyYAML is required to read YAML files")
+                manifest = yaml.safe_load(f)
+            else:
+                manifest = json.load(f)
+        defaults = manifest.pop("defaults", {})
+        jobs = []
+        packs = {}
+        for item in manifest.pop("urls"):
+            if isinstance(item, six.string_types):
+                item = {"url": item}
+            options = dict(defaults)
+            options.update(item)
+            path = options.get("pack")
+            if isinstance(path, six.string_types):
+                if path not in packs:
+                    packs[path] = ArchivePack(path)
+                options['pack'] = packs[path]
+            jobs.append(CaptureJob(**options))
+        manifest.update(kwargs)
+        return cls(jobs, **manifest)
+
+    def get_jitter(self, interval):
+        return random.uniform(-self.jitter, self.jitter) * interval
+
+    def schedule(self, now=None):
+        """
+        Sets the first run time of every job.
+        """
+        now = now or time.time()
+        groups = {}
+        for job in self.jobs:
+            groups.setdefault(job.interval, []).append(job)
+        for interval, job_list in groups.items():
+            step = interval / len(job_list)
+            for i, job in enumerate(job_list):
+                job.base_run = now + (i * step)
+                job.next_run = job.base_run + abs(self.get_jitter(step))
+
+    def get_pending(self, now=None):
+        """
+        Returns the jobs that are due to run.
+        """
+        now = now or time.time()
+        return [j for j in self.jobs if j.next_run <= now]
+
+    def run_job(self, job):
+        """
+        Archives a job's URL and returns the ArchivedURL object.
+        """
+        return storytracker.archive(
+            job.url,
+            output_dir=job.output_dir,
+            fetcher=self.fetcher,
+            **job.archive_kwargs
+        )
+
+    def run_pending(self, now=None):
+        """
+        Archives every job that is due and schedules its next run.
+
+        Returns a list of the ArchivedURL objects created.
+        """
+        now = now or time.time()
+        pending = self.get_pending(now)
+        # Don't spin up the workers when there's nothing to do
+        if not pending:
+            return []
+        obj_list = []
+        results = threaded_imap(self.run_job, pending, workers=self.workers)
+        for job, obj, exc_info in results:
+            if exc_info:
+                logger.error(
+                    "Could not archive %s" % job.url,
+                    exc_info=exc_info
+                )
+            elif obj:
+                obj_list.append(obj)
+            job.last_run = now
+            # Keep to the original rhythm rather than drifting, unless
+            # we have fallen so far behind that we would run again at once
+            job.base_run += job.interval
+            if job.base_run <= now:
+                job.base_run = now + job.interval
+            job.next_run = job.base_run + self.get_jitter(job.interval)
+        return obj_list
+
+    def run_forever(self):
+        """
+        Runs jobs as they come due until ``stop`` is called.
+        """
+        logger.debug("Starting scheduler with %s jobs" % len(self.jobs))
+        if not self.jobs:
+            raise ValueError("There are no jobs to run")
+        try:
+            while not self._stop.is_set():
+                self.run_pending()
+                wait = min(j.next_run for j in self.jobs) - time.time()
+                # Wake up at least once a second so we can be stopped
+                self._stop.wait(max(min(wait, 1), 0))
+        finally:
+            self.fetcher.close()
+
+    def stop(self):
+        self._stop.set()
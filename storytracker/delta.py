@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+import os
+import re
+import json
+import difflib
+import logging
+import threading
+import collections
+from .cache import DirectoryStore
+from .compression import detect_codec, get_codec
+from .manifest import record_archive
+logger = logging.getLogger(__name__)
+
+
+# The file extension given to snapshots stored as a delta
+DELTA_EXTENSION = ".delta"
+
+# Pages are diffed a tag or a line at a time, so minified HTML
+# that sits on a single line still breaks into useful pieces
+TOKEN_RE = re.compile(br"[^>\n]*[>\n]|[^>\n]+")
+
+# How many rebuilt snapshots to keep around for rebuilding the next one
+CACHE_SIZE = 32
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def tokenize(content):
+    """
+    Splits the provided bytes into the pieces that deltas are made of.
+    """
+    return TOKEN_RE.findall(content)
+
+
+def diff(base, content):
+    """
+    Returns a list of operations that rebuild the provided content from
+    the provided base.
+
+    Each is either a two-item list with the start and end of a run of
+    pieces to copy from the base, or a string of new text to insert.
+    """
+    a = tokenize(base)
+    b = tokenize(content)
+    matcher = difflib.SequenceMatcher(None, a, b)
+    ops = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            # Latin-1 maps every byte to a character, so any
+            # bytes make the trip through JSON untouched
+            ops.append(b"".join(b[j1:j2]).decode("latin-1"))
+    return ops
+
+
+def patch(base, ops):
+    """
+    Rebuilds content from the provided base and list of operations.
+    """
+    tokens = tokenize(base)
+    parts = []
+    for op in ops:
+        if isinstance(op, list):
+            parts.append(b"".join(tokens[op[0]:op[1]]))
+        else:
+            parts.append(op.encode("latin-1"))
+    return b"".join(parts)
+
+
+def cache_content(path, content):
+    """
+    Remembers the snapshot stored at the provided path.
+    """
+    with _cache_lock:
+        _cache[path] = content
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def read_archive_content(path):
+    """
+    Returns the undecoded HTML archived at the provided path.
+
+    Compressed files are decompressed, and deltas are rebuilt from the
+    files they were made against.
+    """
+    path = os.path.abspath(path)
+    with _cache_lock:
+        if path in _cache:
+            content = _cache.pop(path)
+            _cache[path] = content
+            return content
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.endswith(DELTA_EXTENSION):
+        delta = json.loads(get_codec("gzip").decompress(data).decode("utf-8"))
+        base_path = os.path.join(os.path.dirname(path), delta['base'])
+        content = patch(read_archive_content(base_path), delta['ops'])
+    else:
+        codec = detect_codec(path=path, data=data)
+        content = codec.decompress(data) if codec else data
+    cache_content(path, content)
+    return content
+
+
+class DeltaStore(DirectoryStore):
+    """
+    Writes successive snapshots of each URL in a directory as deltas
+    against the one before.
+
+    Every ``keyframe_interval`` snapshots a full copy, called a keyframe,
+    is written instead, so no snapshot is more than that many steps from
+    a complete file. The last file written for each URL and the number of
+    deltas since its keyframe are kept in a hidden file in the directory.
+    """
+    filename = ".storytracker-deltas.json"
+
+    def write(
+        self, obj, keyframe_interval=10, compress="gzip", compress_level=None
+    ):
+        """
+        Writes the provided ArchivedURL object to the directory and
+        returns the path of the new file.
+
+        Keyframes are compressed with the named codec, or left as plain
+        HTML if ``compress`` is False.
+        """
+        last = self.get(obj.url)
+        if last and last['count'] + 1 < keyframe_interval:
+            base_path = os.path.join(self.directory, last['path'])
+            try:
+                base = read_archive_content(base_path)
+            except IOError:
+                logger.debug("Could not read %s, writing keyframe" % base_path)
+            else:
+                path = write_delta_to_directory(
+                    obj,
+                    self.directory,
+                    base_path,
+                    base
+                )
+                self.set(obj.url, {
+                    "path": os.path.basename(path),
+                    "count": last['count'] + 1
+                })
+                return path
+        if compress:
+            path = obj.write_compressed_to_directory(
+                self.directory,
+                codec=compress,
+                level=compress_level
+            )
+        else:
+            path = obj.write_html_to_directory(self.directory)
+        cache_content(os.path.abspath(path), obj.encoded_html)
+        self.set(obj.url, {"path": os.path.basename(path), "count": 0})
+        return path
+
+
+def write_delta_to_directory(obj, path, base_path, base):
+    """
+    Writes the provided ArchivedURL object to the provided directory as a
+    delta against the bytes of the archive at ``base_path``.
+    """
+    content = obj.encoded_html
+    delta = json.dumps({
+        "base": os.path.basename(base_path),
+        "ops": diff(base, content),
+    })
+    obj.delta_archive_path = os.path.join(
+        path,
+        "%s%s" % (obj.archive_filename, DELTA_EXTENSION)
+    )
+    with open(obj.delta_archive_path, "wb") as f:
+        f.write(get_codec("gzip").compress(delta.encode("utf-8")))
+    # Hold on to it so the next delta need not be rebuilt from disk
+    cache_content(os.path.abspath(obj.delta_archive_path), content)
+    record_archive(obj, obj.delta_archive_path)
+    return obj.delta_archive_path
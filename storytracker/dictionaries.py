@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+import os
+import logging
+import threading
+import collections
+import storytracker
+from .cache import DirectoryStore
+from .compression import get_codec
+from .manifest import record_archive
+try:
+    from urlparse import urlparse
+except ImportError:
+    from six.moves.urllib.parse import urlparse
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+logger = logging.getLogger(__name__)
+
+
+def require_zstandard():
+    if not zstandard:
+        raise ImportError(
+            "The zstandard library is required to use compression dictionaries"
+        )
+
+
+def get_site(url):
+    """
+    Returns the name of the site a URL belongs to, which is the key each
+    dictionary is filed under.
+    """
+    return urlparse(url).netloc.lower()
+
+
+def get_dictionary_id(data):
+    """
+    Returns the ID of the dictionary the provided zstd data was compressed
+    with, or 0 if none was used.
+    """
+    require_zstandard()
+    return zstandard.get_frame_parameters(data).dict_id
+
+
+class DictionaryStore(DirectoryStore):
+    """
+    Keeps zstd compression dictionaries trained on each site's archives
+    in a directory.
+
+    Snapshots of the same site share a lot of boilerplate markup, so
+    compressing them with a dictionary trained on earlier snapshots is
+    much more effective than compressing each file on its own. zstd
+    records the ID of the dictionary in each file's header, so the right
+    one can be found when the file is read back.
+
+    Each dictionary is saved in a hidden file in the directory, and the
+    latest ID trained for each site is recorded in another.
+    """
+    filename = ".storytracker-dictionaries.json"
+
+    def __init__(self, *args, **kwargs):
+        super(DictionaryStore, self).__init__(*args, **kwargs)
+        self._dictionaries = {}
+        self._dictionaries_lock = threading.Lock()
+
+    def get_dictionary_path(self, dict_id):
+        return os.path.join(
+            self.directory,
+            ".storytracker-dictionary-%s.zdict" % dict_id
+        )
+
+    def get_dictionary(self, dict_id):
+        """
+        Returns the dictionary with the provided ID.
+        """
+        require_zstandard()
+        with self._dictionaries_lock:
+            if dict_id not in self._dictionaries:
+                path = self.get_dictionary_path(dict_id)
+                with open(path, "rb") as f:
+                    data = f.read()
+                self._dictionaries[dict_id] = zstandard.ZstdCompressionDict(
+                    data
+                )
+            return self._dictionaries[dict_id]
+
+    def get_dictionary_for_url(self, url):
+        """
+        Returns the latest dictionary trained for the provided URL's site,
+        or None if there isn't one.
+        """
+        dict_id = self.get(get_site(url))
+        if not dict_id:
+            return None
+        return self.get_dictionary(dict_id)
+
+    def train(self, site, samples, size=112640):
+        """
+        Trains a dictionary of up to ``size`` bytes on the provided list
+        of bytes, saves it for the provided site and returns its ID.
+        """
+        require_zstandard()
+        dictionary = zstandard.train_dictionary(size, list(samples))
+        dict_id = dictionary.dict_id()
+        with open(self.get_dictionary_path(dict_id), "wb") as f:
+            f.write(dictionary.as_bytes())
+        with self._dictionaries_lock:
+            self._dictionaries[dict_id] = dictionary
+        self.set(site, dict_id)
+        logger.debug("Trained dictionary %s for %s" % (dict_id, site))
+        return dict_id
+
+    def compress(self, url, content, level=None):
+        """
+        Compresses the provided bytes with the latest dictionary for the
+        provided URL's site. If there isn't one, they are compressed
+        without one.
+        """
+        require_zstandard()
+        dictionary = self.get_dictionary_for_url(url)
+        if not dictionary:
+            return get_codec("zstd").compress(content, level=level)
+        compressor = zstandard.ZstdCompressor(
+            level=level or get_codec("zstd").default_level,
+            dict_data=dictionary
+        )
+        return compressor.compress(content)
+
+    def decompress(self, data):
+        """
+        Decompresses the provided zstd data with the dictionary named in
+        its header, if there is one.
+        """
+        dict_id = get_dictionary_id(data)
+        if not dict_id:
+            return get_codec("zstd").decompress(data)
+        decompressor = zstandard.ZstdDecompressor(
+            dict_data=self.get_dictionary(dict_id)
+        )
+        return decompressor.decompressobj().decompress(data)
+
+
+def write_dictionary_compressed_to_directory(obj, path, level=None):
+    """
+    Writes the provided ArchivedURL object to a zstd file in the provided
+    directory, compressed with the dictionary trained for its site.
+    """
+    if not os.path.isdir(path):
+        raise ValueError("Path must be a directory")
+    store = DictionaryStore.for_directory(path)
+    obj.compressed_archive_path = os.path.join(
+        path,
+        "%s%s" % (obj.archive_filename, get_codec("zstd").extension)
+    )
+    with open(obj.compressed_archive_path, "wb") as f:
+        f.write(store.compress(obj.url, obj.encoded_html, level=level))
+    record_archive(obj, obj.compressed_archive_path)
+    return obj.compressed_archive_path
+
+
+def train_directory(path, size=112640, max_samples=200, min_samples=10):
+    """
+    Trains a dictionary for every site archived in the provided directory
+    and returns a dictionary mapping each site to the ID of its new
+    dictionary.
+
+    Up to ``max_samples`` of each site's latest snapshots are used.
+    Sites with fewer than ``min_samples`` snapshots are skipped.
+    """
+    # Pick each site's latest snapshots from their names alone, so only
+    # the ones used are read from disk
+    sites = {}
+    for obj in storytracker.iter_archive_directory(path, lazy=True):
+        latest = sites.setdefault(
+            get_site(obj.url),
+            collections.deque(maxlen=max_samples)
+        )
+        latest.append(obj)
+    store = DictionaryStore.for_directory(path)
+    trained = {}
+    for site, latest in sites.items():
+        if len(latest) < min_samples:
+            logger.debug("Not enough snapshots to train %s" % site)
+            continue
+        samples = [obj.encoded_html for obj in latest]
+        trained[site] = store.train(site, samples, size=size)
+    return trained
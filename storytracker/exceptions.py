@@ -3,3 +3,11 @@
 
 class ArchiveFileNameError(ValueError):
     pass
+
+
+class NotModifiedError(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+    pass
@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+import six
+import sys
+import time
+import socket
+import random
+import logging
+import requests
+import threading
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from .exceptions import CircuitOpenError
+try:
+    from urlparse import urlparse
+except ImportError:
+    from six.moves.urllib.parse import urlparse
+logger = logging.getLogger(__name__)
+
+
+# Response status codes that suggest trying again later might work
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class HostCache(object):
+    """
+    A small, time-limited cache of DNS lookups.
+
+    When installed it stands in for ``socket.getaddrinfo`` so that new
+    connections to a host we have already resolved skip the lookup.
+    """
+    def __init__(self, ttl=300, max_size=256):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._original = None
+
+    def getaddrinfo(self, *args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        now = time.time()
+        with self._lock:
+            hit = self._cache.get(key)
+        if hit and hit[0] > now:
+            return hit[1]
+        result = (self._original or socket.getaddrinfo)(*args, **kwargs)
+        with self._lock:
+            # Keep the cache small by throwing out the oldest entry
+            if len(self._cache) >= self.max_size:
+                oldest = min(self._cache, key=lambda k: self._cache[k][0])
+                del self._cache[oldest]
+            self._cache[key] = (now + self.ttl, result)
+        return result
+
+    def install(self):
+        """
+        Route lookups through this cache.
+        """
+        global _system_getaddrinfo
+        with _installed_lock:
+            if self in _installed:
+                return
+            # Only the first cache patches the socket module, and only
+            # the last one out puts it back, so they can be closed in
+            # any order
+            if not _installed:
+                _system_getaddrinfo = socket.getaddrinfo
+                socket.getaddrinfo = _getaddrinfo
+            _installed.append(self)
+            self._original = _system_getaddrinfo
+
+    def uninstall(self):
+        """
+        Stop routing lookups through this cache, restoring the standard
+        lookup function if no other cache is installed.
+        """
+        with _installed_lock:
+            if self not in _installed:
+                return
+            _installed.remove(self)
+            self._original = None
+            if not _installed:
+                socket.getaddrinfo = _system_getaddrinfo
+
+    def clear(self):
+        with self._lock:
+            self._cache = {}
+
+
+# The HostCaches that are installed, newest last, and the lookup
+# function that was in place before the first of them
+_installed = []
+_installed_lock = threading.Lock()
+_system_getaddrinfo = None
+
+
+def _getaddrinfo(*args, **kwargs):
+    # Stands in for socket.getaddrinfo while any HostCache is installed
+    with _installed_lock:
+        cache = _installed[-1] if _installed else None
+    if cache is None:
+        return _system_getaddrinfo(*args, **kwargs)
+    return cache.getaddrinfo(*args, **kwargs)
+
+
+class HostRateLimiter(object):
+    """
+    Limits how hard we hit any one host.
+
+    Each host gets a token bucket that refills at ``rate`` requests per
+    second and holds up to ``burst`` tokens, and no more than
+    ``max_connections`` requests to a host may be open at the same time.
+    Set either to None to turn it off.
+    """
+    def __init__(self, rate=1.0, burst=1, max_connections=2):
+        self.rate = rate
+        self.burst = burst
+        self.max_connections = max_connections
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _get_host(self, host):
+        with self._lock:
+            if host not in self._hosts:
+                semaphore = None
+                if self.max_connections:
+                    semaphore = threading.Semaphore(self.max_connections)
+                self._hosts[host] = {
+                    "tokens": float(self.burst),
+                    "updated": time.time(),
+                    "semaphore": semaphore,
+                    "lock": threading.Lock(),
+                }
+            return self._hosts[host]
+
+    def take_token(self, host):
+        """
+        Waits until the host's bucket has a token and then takes it.
+        """
+        if not self.rate:
+            return
+        state = self._get_host(host)
+        while True:
+            with state['lock']:
+                now = time.time()
+                state['tokens'] = min(
+                    float(self.burst),
+                    state['tokens'] + (now - state['updated']) * self.rate
+                )
+                state['updated'] = now
+                if state['tokens'] >= 1:
+                    state['tokens'] -= 1
+                    return
+                wait = (1 - state['tokens']) / self.rate
+            time.sleep(wait)
+
+    def acquire(self, host):
+        """
+        Waits until a request can be made to the host.
+        """
+        state = self._get_host(host)
+        if state['semaphore']:
+            state['semaphore'].acquire()
+        self.take_token(host)
+
+    def release(self, host):
+        """
+        Records that a request to the host has finished.
+        """
+        state = self._get_host(host)
+        if state['semaphore']:
+            state['semaphore'].release()
+
+    @contextmanager
+    def limit(self, host):
+        self.acquire(host)
+        try:
+            yield
+        finally:
+            self.release(host)
+
+
+class CircuitBreaker(object):
+    """
+    Stops us from wasting time on hosts that keep failing.
+
+    After ``failure_threshold`` failures in a row, requests to a host are
+    refused for ``reset_timeout`` seconds. Then a single trial request is
+    let through. If it works the host is back in business, and if not it is
+    shut off again.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = {}
+        self._opened = {}
+        self._trials = {}
+        self._lock = threading.Lock()
+
+    def is_open(self, host):
+        """
+        Returns True if requests to the host should be refused.
+
+        Once the host has cooled off, the first caller is given the trial
+        request and everyone else is still refused until it is recorded.
+        """
+        with self._lock:
+            opened = self._opened.get(host)
+            if not opened:
+                return False
+            now = time.time()
+            # A trial that never reported back is given up on eventually
+            trial = self._trials.get(host)
+            if trial and now - trial < self.reset_timeout:
+                return True
+            if now - opened >= self.reset_timeout:
+                # Let one request through to test the waters
+                self._trials[host] = now
+                return False
+            return True
+
+    def check(self, host):
+        """
+        Raises CircuitOpenError if requests to the host should be refused.
+        """
+        if self.is_open(host):
+            raise CircuitOpenError(
+                "Skipping %s after too many failures" % host
+            )
+
+    def record_success(self, host):
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened.pop(host, None)
+            self._trials.pop(host, None)
+
+    def record_failure(self, host):
+        with self._lock:
+            self._failures[host] = self._failures.get(host, 0) + 1
+            # A failed trial shuts the host off again straight away
+            if self._trials.pop(host, None) or \
+                    self._failures[host] >= self.failure_threshold:
+                logger.debug("Opening circuit for %s" % host)
+                self._opened[host] = time.time()
+
+
+class Fetcher(object):
+    """
+    A reusable HTTP client that keeps connections open between requests.
+
+    A single ``requests.Session`` is shared by every request so that
+    repeat visits to the same host reuse a pooled keep-alive connection
+    rather than paying for a new handshake each time.
+
+    Requests that fail with a connection error, a timeout or a status code
+    in RETRY_STATUS_CODES are tried again up to ``retries`` times, waiting
+    a random share of an exponentially growing backoff in between. If a
+    ``deadline`` is set, no request, including its retries and reading the
+    response, may take longer than that many seconds.
+    """
+    def __init__(
+        self,
+        pool_connections=10,
+        pool_maxsize=10,
+        pool_block=False,
+        dns_cache_ttl=None,
+        headers=None,
+        rate_limiter=None,
+        connect_timeout=10,
+        read_timeout=60,
+        deadline=None,
+        retries=0,
+        backoff=0.5,
+        max_backoff=30,
+        circuit_breaker=None,
+    ):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Connection": "keep-alive"})
+        if headers:
+            self.session.headers.update(headers)
+        self.rate_limiter = rate_limiter
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.circuit_breaker = circuit_breaker
+        # Optionally remember DNS lookups
+        self.host_cache = None
+        if dns_cache_ttl:
+            self.host_cache = HostCache(ttl=dns_cache_ttl)
+            self.host_cache.install()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_backoff(self, attempt):
+        """
+        Returns how many seconds to wait before the provided retry attempt.
+        """
+        ceiling = min(self.max_backoff, self.backoff * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def get_timeout(self, started):
+        """
+        Returns the timeouts for the next attempt of a request that
+        started at the provided time.
+        """
+        timeout = (self.connect_timeout, self.read_timeout)
+        if not self.deadline:
+            return timeout
+        remaining = self.deadline - (time.time() - started)
+        if remaining <= 0:
+            raise requests.Timeout("Deadline exceeded")
+        return tuple(min(t or remaining, remaining) for t in timeout)
+
+    def send(self, url, started, **kwargs):
+        """
+        Makes a single attempt to request the provided URL.
+        """
+        kwargs.setdefault("timeout", self.get_timeout(started))
+        if self.deadline:
+            kwargs['stream'] = True
+        if self.rate_limiter:
+            # Wait our turn if we are limiting how hard we hit each host,
+            # and hold it until the whole body has been read
+            with self.rate_limiter.limit(urlparse(url).netloc):
+                return self._send(url, started, **kwargs)
+        return self._send(url, started, **kwargs)
+
+    def _send(self, url, started, **kwargs):
+        logger.debug("Requesting %s" % url)
+        response = self.session.get(url, **kwargs)
+        if not self.deadline:
+            return response
+        # Read the body in pieces so a slow trickle can't outlast the deadline
+        chunks = []
+        for chunk in response.iter_content(chunk_size=16384):
+            chunks.append(chunk)
+            if time.time() - started > self.deadline:
+                response.close()
+                raise requests.Timeout("Deadline exceeded reading %s" % url)
+        response._content = b"".join(chunks)
+        return response
+
+    def request(self, url, **kwargs):
+        """
+        Requests the provided URL and returns the response.
+        """
+        host = urlparse(url).netloc
+        if self.circuit_breaker:
+            self.circuit_breaker.check(host)
+        started = time.time()
+        attempt = 0
+        while True:
+            exc_info, response = None, None
+            try:
+                response = self.send(url, started, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                exc_info = sys.exc_info()
+            if not exc_info and \
+                    response.status_code not in RETRY_STATUS_CODES:
+                if self.circuit_breaker:
+                    self.circuit_breaker.record_success(host)
+                return response
+            # Give up if we are out of tries or time
+            wait = self.get_backoff(attempt)
+            out_of_time = self.deadline and \
+                time.time() + wait - started >= self.deadline
+            if attempt >= self.retries or out_of_time:
+                if self.circuit_breaker:
+                    self.circuit_breaker.record_failure(host)
+                if exc_info:
+                    six.reraise(*exc_info)
+                return response
+            # Otherwise take a breather and go again
+            logger.debug("Retrying %s in %.2f seconds" % (url, wait))
+            time.sleep(wait)
+            attempt += 1
+
+    def close(self):
+        """
+        Close all pooled connections.
+        """
+        self.session.close()
+        if self.host_cache:
+            self.host_cache.uninstall()
+
+
+_default_fetcher = None
+_default_fetcher_lock = threading.Lock()
+
+
+def get_default_fetcher():
+    """
+    Returns the Fetcher shared by all calls that do not provide their own.
+    """
+    global _default_fetcher
+    with _default_fetcher_lock:
+        if not _default_fetcher:
+            _default_fetcher = Fetcher()
+        return _default_fetcher
@@ -1,9 +1,25 @@
 #!/usr/bin/env python
 import os
-import gzip
+import re
+import six
+import fnmatch
+import functools
 import storytracker
 import dateutil.parser
-from .analysis import ArchivedURL, ArchivedURLSet
+from datetime import datetime
+from dateutil.tz import tzoffset, tzutc
+from .analysis import ArchivedURL, ArchivedURLSet, LazyArchivedURL
+from .compression import detect_codec
+from .dictionaries import DictionaryStore
+from .delta import DELTA_EXTENSION, read_archive_content
+from .manifest import Manifest
+from .pack import ArchivePack, INDEX_EXTENSION, PACK_EXTENSION
+from .toolbox import threaded_imap
+try:
+    from scandir import walk
+except ImportError:
+    # Python 3's own version already uses the faster os.scandir
+    from os import walk
 try:
     from urlparse import urlunparse, urlparse
 except ImportError:
@@ -28,30 +44,190 @@ def create_archive_filename(url, timestamp):
     )
 
 
-def open_archive_directory(path):
+def open_archive_directory(
+    path, lazy=False, cache=None, use_manifest=False, workers=None
+):
     """
     Accepts a directory path and returns an ArchivedURLSet object
+
+    If ``workers`` is more than one, files are read and decompressed by
+    that many threads at once. The set comes back in the same order
+    either way.
+
+    If ``use_manifest`` is True and the directory has a manifest, the
+    archives are listed from it instead of by walking the directory. It
+    is up to the caller to know the manifest is current.
     """
     # Make sure it's a directory
     if not os.path.isdir(path):
         raise ValueError("Path must be a directory")
 
-    # Loop through the directory and pull the data
+    # If the directory has a manifest, look everything up there
+    if use_manifest and Manifest.exists(path):
+        manifest = Manifest.for_directory(path)
+        openers = (
+            functools.partial(manifest.open, row, lazy=lazy, cache=cache)
+            for row in manifest.query()
+        )
+    else:
+        openers = _iter_directory_openers(path, lazy=lazy, cache=cache)
+
+    # Lazy objects don't read anything, so there is nothing to share out
+    if lazy or not workers or workers < 2:
+        results = (_open(o) for o in openers)
+    else:
+        results = _open_threaded(openers, workers)
     urlset = ArchivedURLSet([])
+    for obj in results:
+        # A pack may hold copies of files that are still in the directory
+        if obj is None or obj in urlset:
+            continue
+        urlset.append(obj)
+    return urlset
+
+
+def _open_threaded(openers, workers):
+    # Yields the result of each opener in order, run on a pool of threads
+    for opener, obj, exc_info in threaded_imap(
+        _open,
+        openers,
+        workers=workers,
+        ordered=True
+    ):
+        if exc_info:
+            six.reraise(*exc_info)
+        yield obj
+
+
+def _iter_directory_openers(path, lazy=False, cache=None):
+    # Yields a function that opens each archive in the directory
     for root, dirs, files in os.walk(path):
+        # Go in order so snapshots of a URL are read one after another,
+        # which lets deltas be rebuilt from the one just before
+        for name in sorted(files):
+            # Skip markers left behind for pages that had not changed
+            if name.endswith((".unchanged", INDEX_EXTENSION)):
+                continue
+            file_path = os.path.join(root, name)
+            # Packs hold many archives
+            if name.endswith(PACK_EXTENSION):
+                pack = ArchivePack(file_path)
+                for entry in pack.entries:
+                    yield functools.partial(
+                        pack.read,
+                        entry,
+                        lazy=lazy,
+                        cache=cache
+                    )
+                continue
+            yield functools.partial(
+                open_archive_filepath,
+                file_path,
+                lazy=lazy,
+                cache=cache
+            )
+
+
+def _open(opener):
+    # Files that aren't archives are skipped
+    try:
+        return opener()
+    except storytracker.ArchiveFileNameError:
+        return None
+
+
+def iter_archive_directory(
+    path, url=None, start=None, end=None, pattern=None, lazy=False,
+    cache=None, use_manifest=False
+):
+    """
+    Accepts a directory path and yields an ArchivedURL object for every
+    archive in it that passes the provided filters, in timestamp order.
+
+    The filters only look at file names, so files are not opened unless
+    they pass, and then only one at a time as they are yielded.
+
+    If ``use_manifest`` is True and the directory has a manifest, the
+    filtering is done there instead.
+    """
+    if not os.path.isdir(path):
+        raise ValueError("Path must be a directory")
+
+    # If the directory has a manifest, the filtering can be done there
+    if use_manifest and Manifest.exists(path):
+        manifest = Manifest.for_directory(path)
+        rows = manifest.query(url=url, start=start, end=end, pattern=pattern)
+        for row in rows:
+            yield manifest.open(row, lazy=lazy, cache=cache)
+        return
+
+    start = _to_naive_utc(start) if start else None
+    end = _to_naive_utc(end) if end else None
+
+    def keep(archive_url, timestamp):
+        if url and archive_url != url:
+            return False
+        if pattern and not fnmatch.fnmatchcase(archive_url, pattern):
+            return False
+        if start and timestamp < start:
+            return False
+        if end and timestamp >= end:
+            return False
+        return True
+
+    # Collect the names that pass along with a way to open each one
+    matches = []
+    for root, dirs, files in walk(path):
         for name in files:
-            path = os.path.join(root, name)
+            if name.endswith((".unchanged", INDEX_EXTENSION)):
+                continue
+            file_path = os.path.join(root, name)
+            if name.endswith(PACK_EXTENSION):
+                pack = ArchivePack(file_path)
+                for entry in pack.entries:
+                    timestamp = _to_naive_utc(
+                        _parse_timestamp(entry['timestamp'])
+                    )
+                    if keep(entry['url'], timestamp):
+                        opener = functools.partial(
+                            pack.read,
+                            entry,
+                            lazy=lazy,
+                            cache=cache
+                        )
+                        matches.append((timestamp, entry['url'], opener))
+                continue
             try:
-                obj = open_archive_filepath(path)
+                archive_url, timestamp = reverse_archive_filename(
+                    os.path.splitext(name)[0]
+                )
             except storytracker.ArchiveFileNameError:
                 continue
-            urlset.append(obj)
+            timestamp = _to_naive_utc(timestamp)
+            if keep(archive_url, timestamp):
+                opener = functools.partial(
+                    open_archive_filepath,
+                    file_path,
+                    lazy=lazy,
+                    cache=cache
+                )
+                matches.append((timestamp, archive_url, opener))
 
-    # Pass it back out
-    return urlset
+    # Then open them in order
+    matches.sort(key=lambda m: (m[0], m[1]))
+    for timestamp, archive_url, opener in matches:
+        yield opener()
 
 
-def open_archive_filepath(path):
+def _to_naive_utc(timestamp):
+    # Timestamps with and without time zones can't be compared,
+    # so assume those without one are in UTC
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(_tz_cache[0]).replace(tzinfo=None)
+
+
+def open_archive_filepath(path, lazy=False, cache=None):
     """
     Accepts a file path and returns an ArchivedURL object
     """
@@ -60,24 +236,107 @@ def open_archive_filepath(path):
     name, ext = os.path.splitext(name)
     # Extract the URL and timestamp from the file name
     url, timestamp = storytracker.reverse_archive_filename(name)
-    # If it is gzipped, then open it that way
-    if ext == '.gz':
-        obj = gzip.open(path)
-        return ArchivedURL(
-            url,
-            timestamp,
-            obj.read().decode("utf-8"),
-            gzip_archive_path=path
-        )
-    # Otherwise handle it normally
+    # Record the path in the attribute that matches the kind of file
+    kwargs = {}
+    codec = detect_codec(path=path)
+    if ext == DELTA_EXTENSION:
+        kwargs['delta_archive_path'] = path
+    elif codec and codec.name == "gzip":
+        kwargs['gzip_archive_path'] = path
+    elif codec:
+        kwargs['compressed_archive_path'] = path
     else:
-        obj = open(path, "rb")
-        return ArchivedURL(
+        kwargs['html_archive_path'] = path
+    # If asked, put off reading the file until the HTML is needed
+    if lazy:
+        return LazyArchivedURL(
             url,
             timestamp,
-            obj.read().decode("utf-8"),
-            html_archive_path=path
+            functools.partial(read_archive_filepath, path),
+            cache=cache,
+            **kwargs
         )
+    return ArchivedURL(
+        url,
+        timestamp,
+        content=read_archive_filepath(path),
+        **kwargs
+    )
+
+
+def read_archive_filepath(path):
+    """
+    Accepts a file path and returns the undecoded HTML archived there
+    """
+    # If it is a delta, rebuild it from the snapshots it was made against
+    if path.endswith(DELTA_EXTENSION):
+        return read_archive_content(path)
+    with open(path, "rb") as f:
+        content = f.read()
+    # If it is compressed, figure out how from the extension
+    # or the first few bytes and then decompress it
+    codec = detect_codec(path=path, data=content)
+    if not codec:
+        return content
+    # zstd files may need the dictionary they were compressed with
+    if codec.name == "zstd":
+        store = DictionaryStore.for_directory(os.path.dirname(path))
+        return store.decompress(content)
+    return codec.decompress(content)
+
+
+# The timestamps written by create_archive_filename, which can be parsed
+# much more quickly than dateutil can manage with anything it is given
+ISOFORMAT_RE = re.compile(
+    r"^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?"
+    r"(?:(Z)|([+-])(\d{2}):(\d{2}))?$"
+)
+
+# URLs already rebuilt from file names, since most directories hold many
+# snapshots of only a few URLs
+_url_cache = {}
+_URL_CACHE_SIZE = 10000
+_tz_cache = {0: tzutc()}
+
+
+def _parse_timestamp(timestamp_string):
+    match = ISOFORMAT_RE.match(timestamp_string)
+    if not match:
+        return dateutil.parser.parse(timestamp_string)
+    (
+        year, month, day, hour, minute, second, fraction,
+        zulu, sign, tz_hour, tz_minute
+    ) = match.groups()
+    tz = None
+    if zulu:
+        tz = _tz_cache[0]
+    elif sign:
+        offset = int(tz_hour) * 3600 + int(tz_minute) * 60
+        if sign == "-":
+            offset = -offset
+        if offset not in _tz_cache:
+            _tz_cache[offset] = tzoffset(None, offset)
+        tz = _tz_cache[offset]
+    return datetime(
+        int(year), int(month), int(day),
+        int(hour), int(minute), int(second),
+        int(fraction.ljust(6, "0")) if fraction else 0,
+        tz
+    )
+
+
+def _parse_url(url_string):
+    try:
+        return _url_cache[url_string]
+    except KeyError:
+        pass
+    urlparts = url_string.split("!")
+    urlparts = [p.replace("|", "/") for p in urlparts]
+    url = urlunparse(urlparts)
+    if len(_url_cache) >= _URL_CACHE_SIZE:
+        _url_cache.clear()
+    _url_cache[url_string] = url
+    return url
 
 
 def reverse_archive_filename(filename):
@@ -88,13 +347,26 @@ def reverse_archive_filename(filename):
     """
     try:
         url_string, timestamp_string = filename.split("@")
-        urlparts = url_string.split("!")
-        urlparts = [p.replace("|", "/") for p in urlparts]
-        return (
-            urlunparse(urlparts),
-            dateutil.parser.parse(timestamp_string)
-        )
-    except:
+        return (_parse_url(url_string), _parse_timestamp(timestamp_string))
+    except (ValueError, TypeError, OverflowError):
         raise storytracker.ArchiveFileNameError(
             "Archive file name could not be parsed from %s:" % filename
         )
+
+
+def reverse_archive_filenames(filenames, fails_silently=False):
+    """
+    Accepts a list of filenames created using the rules of
+    ``create_archive_filename`` and returns a list with the URL string and
+    timestamp of each. If ``fails_silently`` is True, names that cannot
+    be parsed get a None rather than raising an error.
+    """
+    results = []
+    for filename in filenames:
+        try:
+            results.append(reverse_archive_filename(filename))
+        except storytracker.ArchiveFileNameError:
+            if not fails_silently:
+                raise
+            results.append(None)
+    return results
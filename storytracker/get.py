@@ -1,18 +1,120 @@
 #!/usr/bin/env python
+import re
+import codecs
 import logging
-import requests
+from .exceptions import NotModifiedError
+from .fetcher import Fetcher, get_default_fetcher
+from .toolbox import threaded_imap
 logger = logging.getLogger(__name__)
 
 
-def get(url, verify=True):
+# Patterns that find the character set declared in a content-type header
+# or in a <meta> tag near the top of an HTML document
+HEADER_CHARSET_RE = re.compile(r'charset=["\']?([\w\-]+)', re.I)
+META_CHARSET_RE = re.compile(br'<meta[^>]+charset=["\']?([\w\-]+)', re.I)
+
+
+def detect_encoding(content, headers):
     """
-    Retrieves HTML from the provided URL.
+    Returns the character encoding of an HTML document, as declared in its
+    content-type header or in a <meta> tag near its top.
+
+    Pages that don't declare one are taken to be UTF-8 if they decode
+    cleanly as it, and Windows-1252, the usual superset of Latin-1, if not.
+    That is much quicker than guessing from the content on big pages.
+    """
+    match = HEADER_CHARSET_RE.search(headers.get('content-type', ''))
+    if match:
+        encoding = match.group(1)
+    else:
+        match = META_CHARSET_RE.search(content[:4096])
+        encoding = match.group(1).decode("ascii") if match else None
+    if encoding:
+        try:
+            return codecs.lookup(encoding).name
+        except LookupError:
+            pass
+    try:
+        content.decode("utf-8")
+    except UnicodeDecodeError:
+        return "cp1252"
+    return "utf-8"
+
+
+def get_response(url, verify=True, fetcher=None, validator_cache=None):
+    """
+    Requests the provided URL and returns the response, without decoding
+    it or recording its validators.
+
+    If a ValidatorCache is provided, the server is asked to skip the
+    download when the page has not changed since it was last retrieved.
+    NotModifiedError is raised when that happens.
     """
-    # Request the URL
-    logger.debug("Requesting %s" % url)
-    response = requests.get(url)
-    html = response.text
+    # Ask the server to skip the page if it hasn't changed
+    headers = {}
+    if validator_cache:
+        headers = validator_cache.get_headers(url)
+    # Request the URL using a pooled connection
+    fetcher = fetcher or get_default_fetcher()
+    response = fetcher.request(url, headers=headers)
+    if response.status_code == 304:
+        raise NotModifiedError("%s has not been modified" % url)
     # Verify that the response is in fact HTML (but option to skip test)
     if verify and 'html' not in response.headers['content-type']:
         raise ValueError("Response does not have an HTML content-type")
-    return html
+    return response
+
+
+def get(url, verify=True, fetcher=None, validator_cache=None, raw=False):
+    """
+    Retrieves HTML from the provided URL.
+
+    If a ValidatorCache is provided, the server is asked to skip the
+    download when the page has not changed since it was last retrieved.
+    NotModifiedError is raised when that happens.
+
+    If ``raw`` is True, a tuple with the undecoded bytes of the response
+    and their character encoding is returned instead of text.
+    """
+    response = get_response(
+        url,
+        verify=verify,
+        fetcher=fetcher,
+        validator_cache=validator_cache
+    )
+    # Remember the validators for next time
+    if validator_cache:
+        validator_cache.update(url, response)
+    content = response.content
+    encoding = detect_encoding(content, response.headers)
+    if raw:
+        return content, encoding
+    return content.decode(encoding, "replace")
+
+
+def get_many(urls, concurrency=10, verify=True, fetcher=None):
+    """
+    Retrieves HTML from many URLs at once.
+
+    Yields a tuple with each URL and its HTML as they finish. If the
+    request fails the exception is returned in place of the HTML.
+    """
+    close_fetcher = False
+    if not fetcher:
+        fetcher = Fetcher(pool_maxsize=concurrency)
+        close_fetcher = True
+
+    def _get(url):
+        return get(url, verify=verify, fetcher=fetcher)
+
+    try:
+        for url, html, exc_info in threaded_imap(
+            _get,
+            urls,
+            workers=concurrency,
+            ordered=False
+        ):
+            yield url, exc_info[1] if exc_info else html
+    finally:
+        if close_fetcher:
+            fetcher.close()
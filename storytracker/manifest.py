@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+import os
+import sqlite3
+import logging
+import threading
+import storytracker
+import dateutil.parser
+from .cache import DigestCache
+from .compression import detect_codec
+try:
+    from scandir import walk
+except ImportError:
+    from os import walk
+logger = logging.getLogger(__name__)
+
+
+# The name of the file each directory's manifest is kept in
+MANIFEST_FILENAME = ".storytracker-manifest.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (
+    path TEXT NOT NULL,
+    offset INTEGER,
+    url TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    utc TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    codec TEXT,
+    digest TEXT,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS archives_path ON archives (path, offset);
+CREATE INDEX IF NOT EXISTS archives_url ON archives (url, utc);
+CREATE INDEX IF NOT EXISTS archives_utc ON archives (utc);
+"""
+
+COLUMNS = (
+    "path", "offset", "url", "timestamp", "utc", "size", "codec", "digest",
+    "mtime"
+)
+
+
+def get_codec_name(path):
+    """
+    Returns the name of the format the file at the provided path is in,
+    judging by its extension.
+    """
+    from .delta import DELTA_EXTENSION
+    if path.endswith(DELTA_EXTENSION):
+        return "delta"
+    codec = detect_codec(path=path)
+    return codec.name if codec else None
+
+
+def to_utc_string(timestamp):
+    """
+    Returns a string of the provided timestamp in UTC that sorts in
+    chronological order. Timestamps without a time zone are assumed to
+    be in UTC already.
+    """
+    if timestamp.tzinfo is not None:
+        offset = timestamp.utcoffset()
+        timestamp = (timestamp - offset).replace(tzinfo=None)
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+
+class Manifest(object):
+    """
+    A SQLite index of the archives in a directory.
+
+    Records the path, URL, timestamp, size, codec and content digest of
+    every archive, so a directory can be listed and filtered without
+    walking it. Archives in packs are recorded with their offset in the
+    pack.
+
+    Once a manifest has been created in a directory, every archive
+    written there by storytracker is added to it. Files added or removed
+    some other way are picked up by ``update``.
+    """
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.path = os.path.join(self.directory, MANIFEST_FILENAME)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.path,
+            check_same_thread=False
+        )
+        self._connection.row_factory = sqlite3.Row
+        with self._lock:
+            self._connection.executescript(SCHEMA)
+
+    @classmethod
+    def for_directory(cls, directory):
+        """
+        Returns the manifest for the provided directory, creating it if
+        it does not exist.
+        """
+        key = os.path.abspath(directory)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(key)
+            return cls._instances[key]
+
+    @staticmethod
+    def exists(directory):
+        """
+        Returns True if the provided directory has a manifest.
+        """
+        return os.path.exists(os.path.join(directory, MANIFEST_FILENAME))
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM archives"
+            ).fetchone()[0]
+
+    def __repr__(self):
+        return '<Manifest: %s>' % self.directory
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+        with self._instances_lock:
+            self._instances.pop(self.directory, None)
+
+    def _insert(self, rows):
+        sql = "INSERT INTO archives (%s) VALUES (%s)" % (
+            ", ".join(COLUMNS),
+            ", ".join("?" * len(COLUMNS))
+        )
+        with self._lock:
+            with self._connection:
+                for row in rows:
+                    # Files have no offset, and NULLs never count as
+                    # duplicates, so clear out any old row by hand
+                    self._connection.execute(
+                        "DELETE FROM archives WHERE path = ? AND offset IS ?",
+                        (row['path'], row['offset'])
+                    )
+                    self._connection.execute(sql, [row[c] for c in COLUMNS])
+
+    def get_file_row(self, path, obj=None):
+        """
+        Returns the row to record for the archive file at the provided
+        path. The digest is taken from the provided ArchivedURL object, or
+        by reading the file if there isn't one.
+        """
+        name = os.path.basename(path)
+        url, timestamp = storytracker.reverse_archive_filename(
+            os.path.splitext(name)[0]
+        )
+        if obj is None:
+            obj = storytracker.open_archive_filepath(path, lazy=True)
+        stat = os.stat(path)
+        return {
+            "path": os.path.relpath(path, self.directory),
+            "offset": None,
+            "url": url,
+            "timestamp": timestamp.isoformat(),
+            "utc": to_utc_string(timestamp),
+            "size": stat.st_size,
+            "codec": get_codec_name(path),
+            "digest": DigestCache.digest(obj.encoded_html),
+            "mtime": stat.st_mtime,
+        }
+
+    def get_pack_rows(self, pack, entries=None):
+        """
+        Returns the rows to record for the provided ArchivePack's entries,
+        or all of them if none are provided.
+        """
+        mtime = os.stat(pack.path).st_mtime
+        rows = []
+        for entry in entries or pack.entries:
+            rows.append({
+                "path": os.path.relpath(pack.path, self.directory),
+                "offset": entry['offset'],
+                "url": entry['url'],
+                "timestamp": entry['timestamp'],
+                "utc": to_utc_string(
+                    dateutil.parser.parse(entry['timestamp'])
+                ),
+                "size": entry['length'],
+                "codec": entry['codec'],
+                "digest": entry['digest'],
+                "mtime": mtime,
+            })
+        return rows
+
+    def add(self, path, obj=None):
+        """
+        Records the archive file at the provided path.
+        """
+        self._insert([self.get_file_row(path, obj=obj)])
+
+    def add_pack_entry(self, pack, entry):
+        """
+        Records an entry just added to the provided ArchivePack.
+        """
+        rows = self.get_pack_rows(pack, entries=[entry])
+        self._insert(rows)
+        # Keep the whole pack marked as up to date
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    "UPDATE archives SET mtime = ? WHERE path = ?",
+                    (rows[0]['mtime'], rows[0]['path'])
+                )
+
+    def remove(self, path):
+        """
+        Forgets everything recorded for the file at the provided path.
+        """
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    "DELETE FROM archives WHERE path = ?",
+                    (os.path.relpath(path, self.directory),)
+                )
+
+    def update(self, rebuild=False):
+        """
+        Brings the manifest up to date with the files in the directory.
+
+        Files that are new, or have changed size or modification time
+        since they were recorded, are added. Files that are gone are
+        removed. If ``rebuild`` is True, everything is forgotten first.
+
+        Returns the number of archives recorded.
+        """
+        from .pack import ArchivePack, INDEX_EXTENSION, PACK_EXTENSION
+        if rebuild:
+            with self._lock:
+                with self._connection:
+                    self._connection.execute("DELETE FROM archives")
+        # Note the size and modification time of everything we have,
+        # though only the time is of any use for packs
+        known = {}
+        with self._lock:
+            for row in self._connection.execute(
+                "SELECT path, offset, size, mtime FROM archives"
+            ):
+                size = row['size'] if row['offset'] is None else None
+                known[row['path']] = (size, row['mtime'])
+        seen = set()
+        for root, dirs, files in walk(self.directory):
+            for name in files:
+                if name.startswith(".") or \
+                        name.endswith((".unchanged", INDEX_EXTENSION)):
+                    continue
+                path = os.path.join(root, name)
+                relpath = os.path.relpath(path, self.directory)
+                seen.add(relpath)
+                stat = os.stat(path)
+                if name.endswith(PACK_EXTENSION):
+                    if known.get(relpath) == (None, stat.st_mtime):
+                        continue
+                    self.remove(path)
+                    pack = ArchivePack(path)
+                    self._insert(self.get_pack_rows(pack))
+                    continue
+                if known.get(relpath) == (stat.st_size, stat.st_mtime):
+                    continue
+                try:
+                    self.add(path)
+                except storytracker.ArchiveFileNameError:
+                    continue
+        for relpath in set(known) - seen:
+            self.remove(os.path.join(self.directory, relpath))
+        return len(self)
+
+    def query(self, url=None, start=None, end=None, pattern=None):
+        """
+        Returns the rows for the archives that pass the provided filters,
+        in timestamp order.
+
+        ``pattern`` is a shell-style wildcard matched against the URL.
+        """
+        sql = "SELECT * FROM archives"
+        where, params = [], []
+        if url:
+            where.append("url = ?")
+            params.append(url)
+        if pattern:
+            where.append("url GLOB ?")
+            params.append(pattern)
+        if start:
+            where.append("utc >= ?")
+            params.append(to_utc_string(start))
+        if end:
+            where.append("utc < ?")
+            params.append(to_utc_string(end))
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY utc, url"
+        with self._lock:
+            return [dict(row) for row in self._connection.execute(sql, params)]
+
+    def open(self, row, lazy=False, cache=None):
+        """
+        Returns an ArchivedURL object for the provided row.
+        """
+        from .pack import ArchivePack
+        path = os.path.join(self.directory, row['path'])
+        if row['offset'] is None:
+            return storytracker.open_archive_filepath(
+                path,
+                lazy=lazy,
+                cache=cache
+            )
+        entry = {
+            "url": row['url'],
+            "timestamp": row['timestamp'],
+            "offset": row['offset'],
+            "length": row['size'],
+            "codec": row['codec'],
+        }
+        return ArchivePack(path).read(entry, lazy=lazy, cache=cache)
+
+
+def record_archive(obj, path):
+    """
+    Adds the archive of the provided ArchivedURL object at the provided
+    path to its directory's manifest, if the directory has one.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if not Manifest.exists(directory):
+        return
+    Manifest.for_directory(directory).add(path, obj=obj)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+import os
+import json
+import logging
+import functools
+import threading
+import storytracker
+import dateutil.parser
+from .analysis import ArchivedURL, ArchivedURLSet, LazyArchivedURL
+from .cache import DigestCache
+from .compression import get_codec
+from .manifest import Manifest
+logger = logging.getLogger(__name__)
+
+
+# The file extensions given to packs and their indexes
+PACK_EXTENSION = ".stpack"
+INDEX_EXTENSION = ".idx"
+
+
+class ArchivePack(object):
+    """
+    Many archived pages appended one after another to a single file.
+
+    Each record in the pack is a line of JSON describing the page,
+    followed by its compressed HTML and a newline. A sidecar index file
+    holds one line of JSON for each record with its URL, timestamp, the
+    offset and length of its HTML in the pack and a digest of it, so any
+    record can be read without scanning the pack. If the index is lost it
+    can be rebuilt from the pack.
+
+    Records are only ever appended, so packs are safe to copy while they
+    are being written and quick to back up.
+    """
+    def __init__(self, path, codec="gzip", level=None):
+        self.path = path
+        self.index_path = path + INDEX_EXTENSION
+        self.codec = codec
+        self.level = level
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        """
+        Yields an ArchivedURL object for every record in the pack, in the
+        order they were added.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            for entry in self.entries:
+                yield self._read(f, entry)
+
+    def __repr__(self):
+        return '<ArchivePack: %s>' % self.path
+
+    @property
+    def entries(self):
+        """
+        Returns the list of index entries for every record in the pack.
+        """
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load_index()
+            return self._entries
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            if os.path.exists(self.path):
+                return self._scan()
+            return []
+        entries = []
+        with open(self.index_path, "rb") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line.decode("utf-8")))
+                except ValueError:
+                    # Skip a line left half-written by a crash
+                    logger.debug("Skipping bad index line in %s" % self.path)
+        return entries
+
+    def _scan(self):
+        """
+        Reads the index entries out of the pack itself.
+        """
+        entries = []
+        with open(self.path, "rb") as f:
+            while True:
+                line = f.readline()
+                if not line:
+                    break
+                try:
+                    entry = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    logger.debug("Stopping at bad record in %s" % self.path)
+                    break
+                entry['offset'] = f.tell()
+                entries.append(entry)
+                f.seek(entry['length'] + 1, os.SEEK_CUR)
+        return entries
+
+    def rebuild_index(self):
+        """
+        Writes a new index by reading through the pack.
+        """
+        with self._lock:
+            self._entries = self._scan()
+            tmp_path = "%s.tmp" % self.index_path
+            with open(tmp_path, "wb") as f:
+                for entry in self._entries:
+                    f.write(json.dumps(entry).encode("utf-8") + b"\n")
+            os.rename(tmp_path, self.index_path)
+
+    def append(self, obj):
+        """
+        Adds the provided ArchivedURL object to the end of the pack and
+        returns its index entry.
+        """
+        content = obj.encoded_html
+        data = get_codec(self.codec).compress(content, level=self.level)
+        entry = {
+            "url": obj.url,
+            "timestamp": obj.timestamp.isoformat(),
+            "codec": self.codec,
+            "length": len(data),
+            "digest": DigestCache.digest(content),
+        }
+        # Load the index before we add to it
+        entries = self.entries
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(json.dumps(entry).encode("utf-8") + b"\n")
+                entry['offset'] = f.tell()
+                f.write(data + b"\n")
+            with open(self.index_path, "ab") as f:
+                f.write(json.dumps(entry).encode("utf-8") + b"\n")
+            entries.append(entry)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if Manifest.exists(directory):
+            Manifest.for_directory(directory).add_pack_entry(self, entry)
+        return entry
+
+    def extend(self, obj_list):
+        for obj in obj_list:
+            self.append(obj)
+
+    def _read(self, f, entry):
+        f.seek(entry['offset'])
+        data = f.read(entry['length'])
+        return ArchivedURL(
+            entry['url'],
+            dateutil.parser.parse(entry['timestamp']),
+            content=get_codec(entry['codec']).decompress(data)
+        )
+
+    def read(self, entry, lazy=False, cache=None):
+        """
+        Returns an ArchivedURL object for the provided index entry.
+
+        If ``lazy`` is True, the HTML is not read until it is needed.
+        """
+        if lazy:
+            return LazyArchivedURL(
+                entry['url'],
+                dateutil.parser.parse(entry['timestamp']),
+                functools.partial(self.read_content, entry),
+                cache=cache,
+                cache_key=(self.path, entry['offset'])
+            )
+        with open(self.path, "rb") as f:
+            return self._read(f, entry)
+
+    def read_content(self, entry):
+        """
+        Returns the undecoded HTML for the provided index entry.
+        """
+        with open(self.path, "rb") as f:
+            f.seek(entry['offset'])
+            data = f.read(entry['length'])
+        return get_codec(entry['codec']).decompress(data)
+
+    def find(self, url):
+        """
+        Returns the index entries for every record of the provided URL.
+        """
+        return [e for e in self.entries if e['url'] == url]
+
+    def get(self, url, timestamp):
+        """
+        Returns an ArchivedURL object for the record of the provided URL
+        at the provided timestamp.
+        """
+        timestamp = timestamp.isoformat()
+        for entry in self.entries:
+            if entry['url'] == url and entry['timestamp'] == timestamp:
+                return self.read(entry)
+        raise KeyError("%s@%s is not in %s" % (url, timestamp, self.path))
+
+
+def open_archive_pack(path, lazy=False, cache=None):
+    """
+    Accepts a pack file path and returns an ArchivedURLSet object
+    """
+    pack = ArchivePack(path)
+    if lazy:
+        return ArchivedURLSet(
+            pack.read(e, lazy=True, cache=cache) for e in pack.entries
+        )
+    return ArchivedURLSet(pack)
+
+
+def pack_directory(path, pack_path, codec="gzip", level=None, delete=False):
+    """
+    Adds every archive in the provided directory to the pack at the
+    provided path and returns the ArchivePack.
+
+    Files are read one at a time, so directories of any size can be
+    converted. If ``delete`` is True, the files are removed once they are
+    all in the pack.
+    """
+    if not os.path.isdir(path):
+        raise ValueError("Path must be a directory")
+    pack = ArchivePack(pack_path, codec=codec, level=level)
+    packed = []
+    for root, dirs, files in os.walk(path):
+        for name in sorted(files):
+            if name.endswith((PACK_EXTENSION, INDEX_EXTENSION, ".unchanged")):
+                continue
+            file_path = os.path.join(root, name)
+            try:
+                obj = storytracker.open_archive_filepath(file_path)
+            except storytracker.ArchiveFileNameError:
+                continue
+            pack.append(obj)
+            packed.append(file_path)
+    if delete:
+        for file_path in packed:
+            os.remove(file_path)
+            directory = os.path.dirname(os.path.abspath(file_path))
+            if Manifest.exists(directory):
+                Manifest.for_directory(directory).remove(file_path)
+    return pack
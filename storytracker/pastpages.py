@@ -1,12 +1,12 @@
 #!/usr/bin/env python
 import gzip
-import requests
 import storytracker
 from six import BytesIO
 from .analysis import ArchivedURL
+from .fetcher import get_default_fetcher
 
 
-def open_pastpages_url(url, **kwargs):
+def open_pastpages_url(url, fetcher=None, **kwargs):
     """
     Accepts an URL from PastPages and returns an ArchivedURL object if
     there is an HTML archive
@@ -16,7 +16,8 @@ def open_pastpages_url(url, **kwargs):
         "http://www.pastpages.org/screenshot/"
     )[1].replace("/", "")
     # Use that request the HTML archive url from the API
-    html_url = requests.get(
+    fetcher = fetcher or get_default_fetcher()
+    html_url = fetcher.request(
         "http://www.pastpages.org/api/beta/screenshots/%s/" % id_
     ).json()['html']
     # Extract the URL and timestamp from the url
@@ -25,7 +26,7 @@ def open_pastpages_url(url, **kwargs):
         html_filename
     )
     # Get the archived HTML data
-    gzipped = requests.get(html_url).content
-    html = gzip.GzipFile(fileobj=BytesIO(gzipped)).read().decode("utf-8")
+    gzipped = fetcher.request(html_url).content
+    content = gzip.GzipFile(fileobj=BytesIO(gzipped)).read()
     # Pass it all back
-    return ArchivedURL(archive_url, timestamp, html)
+    return ArchivedURL(archive_url, timestamp, content=content)
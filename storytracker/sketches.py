@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+import six
+import math
+import hashlib
+import logging
+logger = logging.getLogger(__name__)
+
+
+class TDigest(object):
+    """
+    Estimates the quantiles of a stream of numbers in bounded memory.
+
+    Numbers are gathered into weighted centroids, which are kept small
+    near the ends of the distribution and allowed to grow in the middle,
+    following Dunning's merging t-digest. No more than a few times
+    ``compression`` centroids are kept, however many numbers are added.
+
+    Estimates are not exact. With the default compression of 100, the
+    rank of an estimated quantile is typically within about 1% of the
+    one asked for near the median, and much closer than that near the
+    extremes. The count, mean, minimum and maximum are exact.
+    """
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.count = 0
+        self.min = None
+        self.max = None
+        self._sum = 0.0
+        self._centroids = []
+        self._buffer = []
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return '<TDigest: %s values>' % self.count
+
+    def add(self, value, weight=1):
+        """
+        Adds a number to the digest.
+        """
+        value = float(value)
+        self._buffer.append((value, weight))
+        self.count += weight
+        self._sum += value * weight
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if len(self._buffer) >= self.compression * 5:
+            self._compress()
+
+    def merge(self, other):
+        """
+        Adds everything in another TDigest to this one.
+        """
+        other._compress()
+        for mean, weight in other._centroids:
+            self._buffer.append((mean, weight))
+        self.count += other.count
+        self._sum += other._sum
+        for value in (other.min, other.max):
+            if value is None:
+                continue
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+        self._compress()
+
+    def _compress(self):
+        # Merge the buffered numbers into the centroids in a single pass
+        if not self._buffer:
+            return
+        points = sorted(self._centroids + self._buffer)
+        self._buffer = []
+        total = float(sum(w for m, w in points))
+        centroids = []
+        mean, weight = points[0]
+        before = 0.0
+        for next_mean, next_weight in points[1:]:
+            proposed = weight + next_weight
+            q = (before + proposed / 2.0) / total
+            # Centroids may only hold a share of the numbers that shrinks
+            # toward the ends of the distribution
+            if proposed <= 4 * total * q * (1 - q) / self.compression:
+                mean += (next_mean - mean) * next_weight / proposed
+                weight = proposed
+            else:
+                centroids.append((mean, weight))
+                before += weight
+                mean, weight = next_mean, next_weight
+        centroids.append((mean, weight))
+        self._centroids = centroids
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self._sum / self.count
+
+    def quantile(self, q):
+        """
+        Returns an estimate of the number that the provided share of the
+        numbers fall below, where ``q`` is between 0 and 1.
+        """
+        if not 0 <= q <= 1:
+            raise ValueError("q must be between 0 and 1")
+        self._compress()
+        if not self._centroids:
+            return None
+        if len(self._centroids) == 1:
+            return self._centroids[0][0]
+        target = q * self.count
+        # Treat each centroid as sitting at the middle of its weight and
+        # interpolate between them, using the extremes at either end
+        previous_mean, previous_rank = self.min, 0.0
+        rank = 0.0
+        for mean, weight in self._centroids:
+            center = rank + weight / 2.0
+            if target < center:
+                span = center - previous_rank
+                if span <= 0:
+                    return mean
+                share = (target - previous_rank) / span
+                return previous_mean + (mean - previous_mean) * share
+            previous_mean, previous_rank = mean, center
+            rank += weight
+        span = self.count - previous_rank
+        if span <= 0:
+            return self.max
+        share = (target - previous_rank) / span
+        return previous_mean + (self.max - previous_mean) * share
+
+    @property
+    def median(self):
+        return self.quantile(0.5)
+
+
+class HyperLogLog(object):
+    """
+    Estimates how many distinct values are in a stream in bounded memory.
+
+    Each value is hashed into one of 2 ** ``precision`` registers, which
+    take a byte each, so the default of 14 uses 16KB no matter how many
+    values are added. The standard error of the estimate is
+    1.04 / sqrt(2 ** precision), about 0.8% with the default.
+    """
+    def __init__(self, precision=14):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.size = 1 << precision
+        self._registers = bytearray(self.size)
+
+    def __len__(self):
+        return self.count()
+
+    def __repr__(self):
+        return '<HyperLogLog: about %s values>' % self.count()
+
+    def add(self, value):
+        """
+        Adds a value, which may be a string or bytes.
+        """
+        if isinstance(value, six.text_type):
+            value = value.encode("utf-8")
+        elif not isinstance(value, six.binary_type):
+            value = six.text_type(value).encode("utf-8")
+        x = int(hashlib.sha1(value).hexdigest()[:16], 16)
+        bits = 64 - self.precision
+        index = x >> bits
+        rest = x & ((1 << bits) - 1)
+        # The position of the first 1 in the rest of the hash
+        rank = bits - rest.bit_length() + 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def merge(self, other):
+        """
+        Adds everything in another HyperLogLog to this one.
+        """
+        if other.precision != self.precision:
+            raise ValueError("Only HyperLogLogs of the same precision merge")
+        for i, rank in enumerate(other._registers):
+            if rank > self._registers[i]:
+                self._registers[i] = rank
+
+    def count(self):
+        """
+        Returns the estimated number of distinct values added.
+        """
+        m = self.size
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self._registers)
+        # Small counts are more accurately estimated from the empty
+        # registers
+        zeros = self._registers.count(b"\x00")
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+import logging
+import threading
+import collections
+import storysniffer
+from .cache import JSONStore
+logger = logging.getLogger(__name__)
+
+
+class StoryClassifier(object):
+    """
+    Guesses whether hrefs link to news stories, remembering the answers.
+
+    The same links turn up on a page snapshot after snapshot, so each
+    href's answer is kept in a cache of up to ``max_size`` hrefs, throwing
+    out the least recently used first.
+
+    If a ``path`` is provided, answers are also kept in a JSON file there
+    so they last from one run to the next. Call ``save`` to write out the
+    new ones.
+    """
+    def __init__(self, max_size=100000, path=None):
+        self.max_size = max_size
+        self.path = path
+        self.store = JSONStore(path, autosave=False) if path else None
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _get(self, href):
+        with self._lock:
+            if href in self._cache:
+                result = self._cache.pop(href)
+                self._cache[href] = result
+                return result
+        if self.store is not None and href in self.store:
+            result = self.store.get(href)
+            self._remember(href, result)
+            return result
+        return None
+
+    def _remember(self, href, result):
+        with self._lock:
+            self._cache.pop(href, None)
+            self._cache[href] = result
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def guess(self, href):
+        """
+        Asks storysniffer about the provided href, without the cache.
+        """
+        try:
+            return bool(storysniffer.guess(href))
+        except (ValueError, TypeError):
+            return False
+
+    def classify(self, href):
+        """
+        Returns True if the provided href is estimated to link to a news
+        story.
+        """
+        result = self._get(href)
+        if result is None:
+            result = self.guess(href)
+            self._remember(href, result)
+            if self.store is not None:
+                self.store.set(href, result)
+        return result
+
+    def classify_hrefs(self, hrefs):
+        """
+        Accepts a list of hrefs and returns a list of True or False
+        estimates of whether each links to a news story.
+
+        Each distinct href is only looked up once.
+        """
+        results = {}
+        for href in hrefs:
+            if href not in results:
+                results[href] = self.classify(href)
+        return [results[href] for href in hrefs]
+
+    def save(self):
+        """
+        Writes the answers out to the file, if there is one.
+        """
+        if self.store is not None:
+            self.store.save()
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+_default_classifier = None
+_default_classifier_lock = threading.Lock()
+
+
+def get_default_classifier():
+    """
+    Returns the StoryClassifier shared by every Hyperlink.
+    """
+    global _default_classifier
+    with _default_classifier_lock:
+        if _default_classifier is None:
+            _default_classifier = StoryClassifier()
+        return _default_classifier
+
+
+def set_default_classifier(classifier):
+    """
+    Replaces the StoryClassifier shared by every Hyperlink, for instance
+    with one that keeps its answers in a file.
+    """
+    global _default_classifier
+    with _default_classifier_lock:
+        _default_classifier = classifier
+
+
+def classify_hrefs(hrefs):
+    """
+    Accepts a list of hrefs and returns a list of True or False estimates
+    of whether each links to a news story, using the shared classifier.
+    """
+    return get_default_classifier().classify_hrefs(hrefs)
@@ -2,8 +2,12 @@
 from __future__ import print_function
 import six
 import re
+import sys
 import math
+import heapq
 import operator
+import threading
+from six.moves import queue
 from functools import reduce
 try:
     import cStringIO as io
@@ -16,6 +20,9 @@ class UnicodeMixin(object):
     Mixin class to handle defining the proper __str__/__unicode__
     methods in Python 2 or 3.
     """
+    # Leave room for subclasses that use slots rather than a __dict__
+    __slots__ = ()
+
     # Python 3
     if six.PY3:
         def __str__(self):
@@ -137,3 +144,121 @@ def wrap_always(text, width):
             int(math.ceil(1.0 * len(text) / width))
         )
     ])
+
+
+def threaded_imap(func, iterable, workers=4, ordered=True, read_ahead=None):
+    """
+    Applies a function to every item in an iterable using a pool of threads.
+
+    Yields a tuple with the item, the function's result and the
+    ``sys.exc_info()`` of any exception it raised (otherwise None).
+
+    Results come back as they finish, unless ``ordered`` is True, in which
+    case they come back in the same order as the iterable. No more than
+    ``read_ahead`` items are pulled from the iterable before their results
+    have been yielded. By default that is twice the number of workers.
+    """
+    workers = max(int(workers), 1)
+    read_ahead = max(int(read_ahead or workers * 2), workers)
+    in_q = queue.Queue()
+    out_q = queue.Queue()
+    slots = threading.Semaphore(read_ahead)
+    stop = threading.Event()
+
+    def feed():
+        count = 0
+        try:
+            for item in iterable:
+                slots.acquire()
+                if stop.is_set():
+                    break
+                in_q.put((count, item))
+                count += 1
+        except Exception:
+            out_q.put(('error', sys.exc_info()))
+        finally:
+            for i in range(workers):
+                in_q.put(None)
+            out_q.put(('done', count))
+
+    def work():
+        while True:
+            job = in_q.get()
+            if job is None or stop.is_set():
+                return
+            i, item = job
+            try:
+                out_q.put(('result', (i, item, func(item), None)))
+            except Exception:
+                out_q.put(('result', (i, item, None, sys.exc_info())))
+
+    threads = [threading.Thread(target=feed)]
+    threads.extend(threading.Thread(target=work) for i in range(workers))
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    total, yielded, next_index, pending = None, 0, 0, {}
+    try:
+        while total is None or yielded < total:
+            kind, payload = out_q.get()
+            if kind == 'done':
+                total = payload
+            elif kind == 'error':
+                six.reraise(*payload)
+            elif not ordered:
+                slots.release()
+                yielded += 1
+                yield payload[1:]
+            else:
+                pending[payload[0]] = payload[1:]
+                while next_index in pending:
+                    slots.release()
+                    yielded += 1
+                    next_index += 1
+                    yield pending.pop(next_index - 1)
+    finally:
+        # Let the feeder and workers wind down if we quit early
+        stop.set()
+        for i in range(read_ahead + 1):
+            slots.release()
+
+
+class RunningMedian(object):
+    """
+    Keeps the median of a stream of numbers as they are added.
+
+    The lower half of the numbers are kept in a max-heap and the upper
+    half in a min-heap, so each new number takes O(log n) and the median
+    is always at hand. Like ``calculate.median``, numbers are treated as
+    floats and the two middle values are averaged when there is an even
+    count.
+    """
+    def __init__(self, values=None):
+        self._low = []
+        self._high = []
+        for value in values or []:
+            self.add(value)
+
+    def __len__(self):
+        return len(self._low) + len(self._high)
+
+    def add(self, value):
+        value = float(value)
+        if self._low and value > -self._low[0]:
+            heapq.heappush(self._high, value)
+        else:
+            heapq.heappush(self._low, -value)
+        # Keep the halves balanced, with any extra one in the lower half
+        if len(self._low) > len(self._high) + 1:
+            heapq.heappush(self._high, -heapq.heappop(self._low))
+        elif len(self._high) > len(self._low):
+            heapq.heappush(self._low, -heapq.heappop(self._high))
+
+    @property
+    def median(self):
+        if not self._low:
+            return None
+        if len(self._low) > len(self._high):
+            return -self._low[0]
+        return (-self._low[0] + self._high[0]) / 2.0
@@ -2,10 +2,14 @@
 import os
 import sys
 import six
+import pytz
 import site
 import glob
+import json
+import time
 import shlex
 import random
+import requests
 import tempfile
 import unittest
 import threading
@@ -13,7 +17,8 @@ import traceback
 import subprocess
 import storytracker
 import multiprocessing
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from bs4 import BeautifulSoup
 from selenium import webdriver
 from wsgiref.simple_server import make_server
@@ -78,6 +83,22 @@ class NullDevice():
         pass
 
 
+@contextmanager
+def story_classifier(guess):
+    """
+    Swaps in a StoryClassifier that guesses with the provided function,
+    rather than asking storysniffer.
+    """
+    original = storytracker.get_default_classifier()
+    classifier = storytracker.StoryClassifier()
+    classifier.guess = guess
+    storytracker.set_default_classifier(classifier)
+    try:
+        yield classifier
+    finally:
+        storytracker.set_default_classifier(original)
+
+
 def hello_world_app(environ, start_response):
     status = '200 OK' # HTTP Status
     headers = [('Content-type', 'text/html')]
@@ -98,11 +119,29 @@ def hello_world_app(environ, start_response):
 </html>"""]
 
 
+def etag_app(environ, start_response):
+    # Only send the page if the client doesn't already have it
+    if environ.get('HTTP_IF_NONE_MATCH') == '"v1"':
+        start_response('304 Not Modified', [('ETag', '"v1"')])
+        return [""]
+    start_response('200 OK', [('Content-type', 'text/html'), ('ETag', '"v1"')])
+    return ["<html><body><a href='/foo/'>Foo</a></body></html>"]
+
+
+def flaky_app(environ, start_response):
+    # Stall on one path and fail on the rest
+    if environ['PATH_INFO'] == '/slow/':
+        time.sleep(2)
+    start_response('503 Service Unavailable', [('Content-type', 'text/html')])
+    return ["<html><body>Try again</body></html>"]
+
+
 class BaseTest(unittest.TestCase):
+    app = staticmethod(hello_world_app)
 
     def setUp(self):
         port = random.choice(range(9000, 9999))
-        server = make_server('', port, hello_world_app)
+        server = make_server('', port, self.app)
         self.server_process = multiprocessing.Process(
             target=server.serve_forever
         )
@@ -138,6 +177,520 @@ class ArchiveTest(MutedTest):
             storytracker.get(self.img)
         storytracker.get(self.img, verify=False)
 
+    def test_fetcher(self):
+        with storytracker.Fetcher(pool_maxsize=2, dns_cache_ttl=60) as f:
+            html1 = storytracker.get(self.url, fetcher=f)
+            html2 = storytracker.get(self.url, fetcher=f)
+            self.assertEqual(html1, html2)
+            self.assertTrue(f.host_cache._cache)
+            obj = storytracker.archive(self.url, fetcher=f)
+            self.assertTrue(isinstance(obj, storytracker.ArchivedURL))
+        self.assertEqual(f.host_cache._original, None)
+        # DNS caches can be closed in any order
+        import socket
+        system_getaddrinfo = socket.getaddrinfo
+        a = storytracker.Fetcher(dns_cache_ttl=60)
+        b = storytracker.Fetcher(dns_cache_ttl=60)
+        a.close()
+        self.assertTrue(socket.getaddrinfo("localhost", 80))
+        b.close()
+        self.assertTrue(socket.getaddrinfo is system_getaddrinfo)
+        self.assertTrue(socket.getaddrinfo("localhost", 80))
+        self.assertTrue(
+            isinstance(
+                storytracker.get_default_fetcher(),
+                storytracker.Fetcher
+            )
+        )
+
+    def test_rate_limiter(self):
+        limiter = storytracker.HostRateLimiter(
+            rate=20,
+            burst=2,
+            max_connections=1
+        )
+        start = time.time()
+        for i in range(4):
+            limiter.take_token("example.com")
+        # Two come from the burst, then we wait 1/20th of a second for each
+        self.assertTrue(time.time() - start >= 0.09)
+        # Other hosts have their own buckets
+        start = time.time()
+        limiter.take_token("example.org")
+        self.assertTrue(time.time() - start < 0.05)
+        # Only one request to a host can be open at a time
+        fetcher = storytracker.Fetcher(rate_limiter=limiter)
+        obj_list = list(storytracker.archive_many(
+            [self.url] * 3,
+            concurrency=3,
+            fetcher=fetcher
+        ))
+        self.assertEqual(len(obj_list), 3)
+        state = limiter._get_host(self.url.split("/")[2])
+        self.assertTrue(state['semaphore'].acquire(False))
+
+    def test_archive_many(self):
+        bad_url = "http://localhost:1/"
+        obj_list = list(storytracker.archive_many(
+            [self.url, bad_url, self.url, self.url],
+            concurrency=2
+        ))
+        self.assertEqual(len(obj_list), 3)
+        for obj in obj_list:
+            self.assertTrue(isinstance(obj, storytracker.ArchivedURL))
+        with self.assertRaises(Exception):
+            list(storytracker.archive_many(
+                [bad_url],
+                fails_silently=False
+            ))
+        results = dict(storytracker.get_many([self.url, bad_url]))
+        self.assertTrue(isinstance(results[self.url], six.text_type))
+        self.assertTrue(isinstance(results[bad_url], Exception))
+
+    def test_threaded_imap(self):
+        from storytracker.toolbox import threaded_imap
+        results = threaded_imap(
+            lambda x: x * 2,
+            range(50),
+            workers=4,
+            ordered=True
+        )
+        self.assertEqual([r[1] for r in results], list(range(0, 100, 2)))
+        results = threaded_imap(lambda x: 1 / x, [1, 0], ordered=False)
+        errors = [r[2] for r in results if r[2]]
+        self.assertEqual(errors[0][0], ZeroDivisionError)
+
+    def test_rewrite_html(self):
+        from storytracker.archive import rewrite_html
+        html = """<html><head><link rel="stylesheet" href="/a.css">
+<script src="b.js"></script></head><body><a href="../c/">C &amp; D</a>
+<img src="e.jpg"/><a name="f">F</a></body></html>"""
+        base = "http://example.com/dir/page.html"
+        for minify in [True, False]:
+            for engine in ["stream", "soup"]:
+                out = rewrite_html(html, base, minify=minify, engine=engine)
+                self.assertTrue("http://example.com/a.css" in out)
+                self.assertTrue("http://example.com/dir/b.js" in out)
+                self.assertTrue("http://example.com/c/" in out)
+                self.assertTrue("http://example.com/dir/e.jpg" in out)
+                self.assertTrue("C &amp; D" in out)
+        # Without extending, the stream engine should match plain htmlmin
+        self.assertEqual(
+            rewrite_html(html, base, extend_urls=False),
+            rewrite_html(html, base, extend_urls=False, engine="soup")
+        )
+        self.assertEqual(
+            rewrite_html(html, base, minify=False, extend_urls=False),
+            html
+        )
+        with self.assertRaises(ValueError):
+            rewrite_html(html, base, engine="foo")
+
+    def test_raw_bytes(self):
+        from storytracker.get import detect_encoding
+        content, encoding = storytracker.get(self.url, raw=True)
+        self.assertTrue(isinstance(content, six.binary_type))
+        self.assertEqual(encoding, "utf-8")
+        self.assertEqual(
+            detect_encoding(b'<meta charset="ISO-8859-1">', {}),
+            "iso8859-1"
+        )
+        self.assertEqual(
+            detect_encoding(b'', {'content-type': 'text/html; charset=UTF8'}),
+            "utf-8"
+        )
+        self.assertEqual(detect_encoding(b'', {}), "utf-8")
+        # Undeclared pages that aren't UTF-8 are read as Windows-1252
+        self.assertEqual(detect_encoding(b'caf\xc3\xa9', {}), "utf-8")
+        self.assertEqual(detect_encoding(b'caf\xe9 \x93hi\x94', {}), "cp1252")
+        self.assertEqual(
+            detect_encoding(b'caf\xe9', {'content-type': 'charset=bogus'}),
+            "cp1252"
+        )
+        # Without any rewriting the bytes should be passed straight through
+        obj = storytracker.archive(
+            self.url,
+            minify=False,
+            extend_urls=False,
+            output_dir=self.tmpdir
+        )
+        self.assertEqual(obj._html, None)
+        self.assertEqual(obj.encoded_html, content)
+        obj2 = storytracker.open_archive_filepath(obj.archive_path)
+        self.assertEqual(obj2._html, None)
+        self.assertEqual(obj, obj2)
+        self.assertEqual(obj2.html, content.decode("utf-8"))
+        # Bytes in other encodings are converted to UTF-8 when written
+        obj3 = storytracker.ArchivedURL(
+            self.url,
+            datetime.now(),
+            content=u"caf\xe9".encode("latin-1"),
+            encoding="iso8859-1"
+        )
+        self.assertEqual(obj3.encoded_html, u"caf\xe9".encode("utf-8"))
+
+    def test_compression(self):
+        from storytracker.compression import CODECS
+        obj = storytracker.archive(self.url, output_dir=self.tmpdir)
+        self.assertTrue(obj.archive_path.endswith(".gz"))
+        self.assertEqual(
+            storytracker.detect_codec(data=obj.gzip).name,
+            "gzip"
+        )
+        self.assertEqual(storytracker.detect_codec(data=b"<html>"), None)
+        # Every codec we have should make the round trip
+        for name, codec in CODECS.items():
+            data = obj.compress(name, level=1)
+            self.assertEqual(codec.decompress(data), obj.encoded_html)
+            subdir = os.path.join(self.tmpdir, name)
+            os.mkdir(subdir)
+            path = obj.write_compressed_to_directory(subdir, codec=name)
+            self.assertTrue(path.endswith(codec.extension))
+            self.assertEqual(obj.archive_path, path)
+            obj2 = storytracker.open_archive_filepath(path)
+            self.assertEqual(obj, obj2)
+            obj.compressed_archive_path = obj.gzip_archive_path = None
+        # Compressed files can be recognized even without the extension
+        path = os.path.join(self.tmpdir, "%s.html" % obj.archive_filename)
+        with open(path, "wb") as f:
+            f.write(obj.compress("bz2"))
+        obj3 = storytracker.open_archive_filepath(path)
+        self.assertEqual(obj3.encoded_html, obj.encoded_html)
+        # Asking for a codec we do not have should fail
+        self.assertRaises(ValueError, obj.compress, "nonsense")
+        obj4 = storytracker.archive(
+            self.url,
+            output_dir=self.tmpdir,
+            compress="bz2",
+            compress_level=1
+        )
+        self.assertTrue(obj4.archive_path.endswith(".bz2"))
+
+    def test_delta(self):
+        from storytracker.delta import DeltaStore, clear_cache, diff, patch
+        base = b"<html><body><h1>Hello</h1>\n<p>World</p></body></html>"
+        content = b"<html><body><h1>Goodbye</h1>\n<p>World</p></body></html>"
+        self.assertEqual(patch(base, diff(base, content)), content)
+        self.assertEqual(patch(b"", diff(b"", content)), content)
+        self.assertEqual(patch(content, diff(content, b"")), b"")
+        # Write a series of snapshots that change a little each time
+        store = DeltaStore.for_directory(self.tmpdir)
+        now = datetime.now()
+        obj_list = []
+        for i in range(7):
+            obj = storytracker.ArchivedURL(
+                self.url,
+                now + timedelta(minutes=i),
+                content=b"<html><p>Story %s</p><p>\xe2\x9c\x93</p></html>" % i
+            )
+            store.write(obj, keyframe_interval=3)
+            obj_list.append(obj)
+        exts = [os.path.splitext(o.archive_path)[1] for o in obj_list]
+        self.assertEqual(
+            exts,
+            [".gz", ".delta", ".delta", ".gz", ".delta", ".delta", ".gz"]
+        )
+        # They should come back out just the same, even with nothing cached
+        clear_cache()
+        for obj in obj_list:
+            obj2 = storytracker.open_archive_filepath(obj.archive_path)
+            self.assertEqual(obj2.encoded_html, obj.encoded_html)
+        urlset = storytracker.open_archive_directory(self.tmpdir)
+        self.assertEqual(len(urlset), 7)
+        # And archive should be able to do it too
+        obj3 = storytracker.archive(
+            self.url,
+            output_dir=self.tmpdir,
+            delta=True,
+            keyframe_interval=3
+        )
+        self.assertTrue(obj3.archive_path.endswith(".delta"))
+        clear_cache()
+        obj4 = storytracker.open_archive_filepath(obj3.archive_path)
+        self.assertEqual(obj3.encoded_html, obj4.encoded_html)
+
+    def test_pack(self):
+        # Fill a directory with a few archives
+        now = datetime.now(pytz.utc)
+        obj_list = []
+        for i in range(5):
+            obj = storytracker.ArchivedURL(
+                self.url,
+                now + timedelta(minutes=i),
+                content=b"<html><p>Story %s</p></html>" % i
+            )
+            obj.write_gzip_to_directory(self.tmpdir)
+            obj_list.append(obj)
+        # Convert it into a pack
+        pack_path = os.path.join(self.tmpdir, "archive.stpack")
+        pack = storytracker.pack_directory(
+            self.tmpdir,
+            pack_path,
+            codec="bz2",
+            delete=True
+        )
+        self.assertEqual(len(pack), 5)
+        self.assertEqual(
+            sorted(os.listdir(self.tmpdir)),
+            ["archive.stpack", "archive.stpack.idx"]
+        )
+        self.assertEqual(list(pack), obj_list)
+        # Any archive can be pulled out on its own
+        self.assertEqual(pack.get(self.url, obj_list[3].timestamp), obj_list[3])
+        self.assertEqual(len(pack.find(self.url)), 5)
+        self.assertRaises(KeyError, pack.get, "http://www.example.com", now)
+        # Directories can hold packs too
+        self.assertEqual(len(storytracker.open_archive_directory(self.tmpdir)), 5)
+        # Add one more through archive
+        obj = storytracker.archive(self.url, pack=pack)
+        reopened = storytracker.open_archive_pack(pack_path)
+        self.assertEqual(len(reopened), 6)
+        self.assertEqual(reopened[-1], obj)
+        # The index can be rebuilt if it goes missing
+        os.remove(pack.index_path)
+        pack2 = storytracker.ArchivePack(pack_path)
+        self.assertEqual(pack2.entries, pack.entries)
+        pack2.rebuild_index()
+        self.assertTrue(os.path.exists(pack.index_path))
+        # Packs that sit next to the files they were made from
+        # don't add copies of them
+        both_dir = tempfile.mkdtemp()
+        for obj in obj_list[:3]:
+            obj.write_gzip_to_directory(both_dir)
+        storytracker.pack_directory(
+            both_dir,
+            os.path.join(both_dir, "all.stpack")
+        )
+        urlset = storytracker.open_archive_directory(both_dir)
+        self.assertEqual(len(urlset), 3)
+        urlset = storytracker.open_archive_directory(both_dir, workers=2)
+        self.assertEqual(len(urlset), 3)
+        # Snapshots skipped as duplicates stay out of the pack too
+        dedup_dir = tempfile.mkdtemp()
+        dedup_pack = storytracker.ArchivePack(
+            os.path.join(dedup_dir, "dedup.stpack")
+        )
+        for i in range(2):
+            storytracker.archive(
+                self.url,
+                output_dir=dedup_dir,
+                pack=dedup_pack,
+                dedup="skip"
+            )
+        self.assertEqual(len(dedup_pack), 1)
+        self.assertEqual(len(storytracker.open_archive_directory(dedup_dir)), 1)
+
+    def test_lazy(self):
+        now = datetime.now()
+        obj_list = []
+        for i in range(4):
+            obj = storytracker.ArchivedURL(
+                self.url,
+                now + timedelta(minutes=i),
+                content=b"<html><p>Story %s</p></html>" % i
+            )
+            obj.write_gzip_to_directory(self.tmpdir)
+            obj_list.append(obj)
+        # Nothing is read until it is needed
+        lazy = storytracker.open_archive_filepath(
+            obj_list[0].archive_path,
+            lazy=True
+        )
+        self.assertTrue(isinstance(lazy, storytracker.LazyArchivedURL))
+        self.assertEqual(lazy._content, None)
+        self.assertEqual(lazy.html, u"<html><p>Story 0</p></html>")
+        self.assertEqual(lazy, obj_list[0])
+        self.assertTrue(lazy._content)
+        lazy.html = u"<html></html>"
+        self.assertEqual(lazy.encoded_html, b"<html></html>")
+        # With a cache, only so many pages are held in memory
+        cache = storytracker.BodyCache(max_size=2)
+        urlset = storytracker.open_archive_directory(
+            self.tmpdir,
+            lazy=True,
+            cache=cache
+        )
+        self.assertEqual(len(cache), 0)
+        for obj, lazy in zip(obj_list, sorted(urlset)):
+            self.assertEqual(lazy.html, obj.html)
+            self.assertEqual(lazy._content, None)
+        self.assertEqual(len(cache), 2)
+
+    def test_iter_archive_directory(self):
+        now = datetime(2014, 7, 6, 12, tzinfo=pytz.utc)
+        for i in range(6):
+            for url in [self.url, "http://www.example.com/"]:
+                obj = storytracker.ArchivedURL(
+                    url,
+                    now + timedelta(days=i),
+                    content=b"<html><p>Story %s</p></html>" % i
+                )
+                obj.write_gzip_to_directory(self.tmpdir)
+        # Throw in a file that isn't an archive
+        open(os.path.join(self.tmpdir, "foo.bar"), "wb").close()
+        obj_list = list(storytracker.iter_archive_directory(self.tmpdir))
+        self.assertEqual(len(obj_list), 12)
+        self.assertEqual(obj_list, sorted(obj_list))
+        # Filter by URL
+        obj_list = list(storytracker.iter_archive_directory(
+            self.tmpdir,
+            url=self.url
+        ))
+        self.assertEqual(len(obj_list), 6)
+        self.assertEqual(set(o.url for o in obj_list), set([self.url]))
+        obj_list = list(storytracker.iter_archive_directory(
+            self.tmpdir,
+            pattern="*example.com*"
+        ))
+        self.assertEqual(len(obj_list), 6)
+        # Filter by time, with or without a time zone
+        obj_list = list(storytracker.iter_archive_directory(
+            self.tmpdir,
+            url=self.url,
+            start=now + timedelta(days=1),
+            end=datetime(2014, 7, 9, 12)
+        ))
+        self.assertEqual(
+            [o.timestamp for o in obj_list],
+            [now + timedelta(days=1), now + timedelta(days=2)]
+        )
+
+    def test_manifest(self):
+        now = datetime(2014, 7, 6, 12, tzinfo=pytz.utc)
+        obj_list = []
+        for i in range(3):
+            obj = storytracker.ArchivedURL(
+                self.url,
+                now + timedelta(days=i),
+                content=b"<html><p>Story %s</p></html>" % i
+            )
+            obj.write_gzip_to_directory(self.tmpdir)
+            obj_list.append(obj)
+        # Index what is already there
+        manifest = storytracker.Manifest.for_directory(self.tmpdir)
+        self.assertEqual(manifest.update(), 3)
+        self.assertEqual(manifest.update(), 3)
+        row = manifest.query()[0]
+        self.assertEqual(row['url'], self.url)
+        self.assertEqual(row['codec'], "gzip")
+        self.assertEqual(
+            row['digest'],
+            storytracker.cache.DigestCache.digest(obj_list[0].encoded_html)
+        )
+        # New archives are added as they are written
+        obj = storytracker.archive(self.url, output_dir=self.tmpdir)
+        self.assertEqual(len(manifest), 4)
+        pack = storytracker.ArchivePack(
+            os.path.join(self.tmpdir, "archive.stpack")
+        )
+        pack.append(storytracker.ArchivedURL(
+            self.url,
+            now - timedelta(days=1),
+            content=b"<html><p>Old story</p></html>"
+        ))
+        self.assertEqual(len(manifest), 5)
+        # And the directory is opened from it when asked
+        self.assertEqual(len(storytracker.open_archive_directory(
+            self.tmpdir,
+            use_manifest=True
+        )), 5)
+        obj_list2 = list(storytracker.iter_archive_directory(
+            self.tmpdir,
+            start=now + timedelta(days=1),
+            end=datetime(2014, 7, 8, 12),
+            use_manifest=True
+        ))
+        self.assertEqual(obj_list2, [obj_list[1]])
+        # Files it doesn't know about are still found by default
+        subdir = os.path.join(self.tmpdir, "later")
+        os.mkdir(subdir)
+        later = storytracker.ArchivedURL(
+            self.url,
+            now + timedelta(days=5),
+            content=b"<html><p>Later story</p></html>"
+        )
+        later_path = os.path.join(subdir, "%s.gz" % later.archive_filename)
+        later.write_gzip_to_path(later_path)
+        self.assertEqual(len(manifest), 5)
+        self.assertEqual(len(storytracker.open_archive_directory(
+            self.tmpdir,
+            use_manifest=True
+        )), 5)
+        self.assertEqual(
+            len(storytracker.open_archive_directory(self.tmpdir)),
+            6
+        )
+        self.assertEqual(list(storytracker.iter_archive_directory(
+            self.tmpdir,
+            start=now + timedelta(days=4),
+            end=now + timedelta(days=6)
+        )), [later])
+        os.remove(later_path)
+        # Files that disappear are dropped by an update
+        os.remove(obj.archive_path)
+        self.assertEqual(manifest.update(), 4)
+        self.assertEqual(manifest.update(rebuild=True), 4)
+        manifest.close()
+
+    def test_dictionary(self):
+        from storytracker import dictionaries
+        # Only each site's latest snapshots are read to train on
+        now = datetime.now()
+        for i in range(12):
+            storytracker.ArchivedURL(
+                self.url,
+                now - timedelta(days=1, minutes=i),
+                content=b"<p>Old story number %s</p>" % i
+            ).write_gzip_to_directory(self.tmpdir)
+        store = dictionaries.DictionaryStore.for_directory(self.tmpdir)
+        trained_on = []
+        store.train = lambda site, samples, size: trained_on.extend(samples)
+        try:
+            dictionaries.train_directory(
+                self.tmpdir,
+                max_samples=5,
+                min_samples=2
+            )
+        finally:
+            del store.train
+        self.assertEqual(
+            sorted(trained_on),
+            [b"<p>Old story number %s</p>" % i for i in range(5)]
+        )
+        for name in os.listdir(self.tmpdir):
+            os.remove(os.path.join(self.tmpdir, name))
+        if not dictionaries.zstandard:
+            self.assertRaises(
+                ImportError,
+                dictionaries.get_dictionary_id,
+                b""
+            )
+            return
+        # Fill a directory with snapshots to train on
+        now = datetime.now()
+        for i in range(50):
+            obj = storytracker.ArchivedURL(
+                self.url,
+                now + timedelta(minutes=i),
+                content=b"<html><div class='nav'>Home</div>"
+                        b"<p>Story number %s</p></html>" % i * 20
+            )
+            obj.write_compressed_to_directory(self.tmpdir, codec="zstd")
+        trained = dictionaries.train_directory(self.tmpdir, size=4096)
+        site = dictionaries.get_site(self.url)
+        self.assertTrue(trained[site])
+        # New archives should use it, and note that in their headers
+        obj = storytracker.archive(
+            self.url,
+            output_dir=self.tmpdir,
+            dictionary=True
+        )
+        with open(obj.archive_path, "rb") as f:
+            data = f.read()
+        self.assertEqual(dictionaries.get_dictionary_id(data), trained[site])
+        obj2 = storytracker.open_archive_filepath(obj.archive_path)
+        self.assertEqual(obj, obj2)
+
     def test_filenaming(self):
         now = datetime.now()
         filename = storytracker.create_archive_filename(self.url, now)
@@ -146,6 +699,26 @@ class ArchiveTest(MutedTest):
         self.assertEqual(now, then)
         with self.assertRaises(storytracker.ArchiveFileNameError):
             storytracker.reverse_archive_filename("foo.bar")
+        # Time zones and odd timestamps should come back the same way
+        aware = datetime(2014, 7, 6, 16, 31, 57, tzinfo=pytz.utc)
+        filename2 = storytracker.create_archive_filename(self.url, aware)
+        url2, then2 = storytracker.reverse_archive_filename(filename2)
+        self.assertEqual(then2, aware)
+        self.assertEqual(then2.utcoffset(), timedelta(0))
+        url3, then3 = storytracker.reverse_archive_filename(
+            "http!example.com!!!!@July 4, 2014"
+        )
+        self.assertEqual(then3, datetime(2014, 7, 4))
+        # Many can be done at once
+        self.assertEqual(
+            storytracker.reverse_archive_filenames(
+                [filename, "foo.bar", filename2],
+                fails_silently=True
+            ),
+            [(url, then), None, (url2, then2)]
+        )
+        with self.assertRaises(storytracker.ArchiveFileNameError):
+            storytracker.reverse_archive_filenames([filename, "foo.bar"])
 
     def test_archive(self):
         self.archive = storytracker.archive(self.url)
@@ -166,6 +739,210 @@ class ArchiveTest(MutedTest):
         os.remove(obj5.html_archive_path)
 
 
+class DaemonTest(MutedTest):
+
+    def test_scheduler(self):
+        from storytracker.daemon import CaptureJob, Scheduler
+        manifest_path = os.path.join(self.tmpdir, 'manifest.json')
+        with open(manifest_path, 'w') as f:
+            json.dump({
+                "defaults": {"interval": 60, "output_dir": self.tmpdir},
+                "jitter": 0,
+                "workers": 2,
+                "urls": [self.url, {"url": self.url, "compress": False}],
+            }, f)
+        scheduler = Scheduler.from_manifest(manifest_path)
+        scheduler.schedule(now=1000)
+        # The jobs should be spread evenly across the interval
+        self.assertEqual(
+            [j.next_run for j in scheduler.jobs],
+            [1000, 1030]
+        )
+        self.assertEqual(len(scheduler.run_pending(now=1000)), 1)
+        self.assertEqual(scheduler.jobs[0].next_run, 1060)
+        self.assertEqual(len(scheduler.run_pending(now=1030)), 1)
+        self.assertEqual(len(scheduler.run_pending(now=1031)), 0)
+        urlset = storytracker.open_archive_directory(self.tmpdir)
+        self.assertEqual(len(urlset), 2)
+        scheduler.fetcher.close()
+        # Captures with nowhere to go are refused up front
+        with open(manifest_path, 'w') as f:
+            json.dump({"urls": [self.url]}, f)
+        with self.assertRaises(ValueError):
+            Scheduler.from_manifest(manifest_path)
+        with self.assertRaises(ValueError):
+            CaptureJob(self.url, pack="archive.stpack")
+        # Jobs that name the same pack add to it together
+        pack_path = os.path.join(self.tmpdir, 'archive.stpack')
+        with open(manifest_path, 'w') as f:
+            json.dump({
+                "defaults": {"interval": 60, "pack": pack_path},
+                "jitter": 0,
+                "urls": [self.url, {"url": self.url, "compress": False}],
+            }, f)
+        scheduler = Scheduler.from_manifest(manifest_path)
+        pack = scheduler.jobs[0].archive_kwargs['pack']
+        self.assertTrue(pack is scheduler.jobs[1].archive_kwargs['pack'])
+        scheduler.schedule(now=1000)
+        self.assertEqual(len(scheduler.run_pending(now=1030)), 2)
+        self.assertEqual(len(storytracker.open_archive_pack(pack_path)), 2)
+        scheduler.fetcher.close()
+
+
+class RetryTest(MutedTest):
+    app = staticmethod(flaky_app)
+
+    def test_retries(self):
+        fetcher = storytracker.Fetcher(retries=2, backoff=0.01)
+        self.assertEqual(fetcher.request(self.url).status_code, 503)
+        with self.assertRaises(requests.ConnectionError):
+            fetcher.request("http://localhost:1/")
+
+    def test_timeouts(self):
+        start = time.time()
+        fetcher = storytracker.Fetcher(read_timeout=0.2)
+        with self.assertRaises(requests.Timeout):
+            fetcher.request(self.url + "slow/")
+        self.assertTrue(time.time() - start < 1.5)
+        start = time.time()
+        fetcher = storytracker.Fetcher(deadline=0.5, retries=10)
+        with self.assertRaises(requests.Timeout):
+            fetcher.request(self.url + "slow/")
+        self.assertTrue(time.time() - start < 1.5)
+
+    def test_circuit_breaker(self):
+        breaker = storytracker.CircuitBreaker(
+            failure_threshold=2,
+            reset_timeout=0.2
+        )
+        fetcher = storytracker.Fetcher(circuit_breaker=breaker)
+        fetcher.request(self.url)
+        fetcher.request(self.url)
+        with self.assertRaises(storytracker.CircuitOpenError):
+            fetcher.request(self.url)
+        # Once it has cooled off a single trial request is let through
+        time.sleep(0.3)
+        fetcher.request(self.url)
+        with self.assertRaises(storytracker.CircuitOpenError):
+            fetcher.request(self.url)
+        # And only one, however many callers are waiting
+        breaker.record_failure("example.com")
+        breaker.record_failure("example.com")
+        time.sleep(0.3)
+        self.assertFalse(breaker.is_open("example.com"))
+        self.assertTrue(breaker.is_open("example.com"))
+        breaker.record_success("example.com")
+        self.assertFalse(breaker.is_open("example.com"))
+        self.assertFalse(breaker.is_open("example.com"))
+
+
+class DedupTest(MutedTest):
+
+    def test_dedup_skip(self):
+        obj1 = storytracker.archive(
+            self.url,
+            output_dir=self.tmpdir,
+            dedup="skip"
+        )
+        self.assertTrue(os.path.exists(obj1.archive_path))
+        obj2 = storytracker.archive(
+            self.url,
+            output_dir=self.tmpdir,
+            dedup="skip"
+        )
+        self.assertEqual(obj2, None)
+        self.assertEqual(len(storytracker.open_archive_directory(self.tmpdir)), 1)
+
+    def test_dedup_link(self):
+        obj1 = storytracker.archive(
+            self.url,
+            output_dir=self.tmpdir,
+            compress=False,
+            dedup="link"
+        )
+        obj2 = storytracker.archive(
+            self.url,
+            output_dir=self.tmpdir,
+            compress=False,
+            dedup="link"
+        )
+        self.assertNotEqual(obj1.archive_path, obj2.archive_path)
+        self.assertEqual(
+            os.stat(obj1.archive_path).st_ino,
+            os.stat(obj2.archive_path).st_ino
+        )
+        self.assertEqual(
+            storytracker.open_archive_filepath(obj2.archive_path).html,
+            obj2.html
+        )
+        # Changing the format means the file has to be written out again
+        obj3 = storytracker.archive(
+            self.url,
+            output_dir=self.tmpdir,
+            dedup="link"
+        )
+        self.assertTrue(obj3.archive_path.endswith(".gz"))
+        self.assertEqual(len(storytracker.open_archive_directory(self.tmpdir)), 3)
+
+
+class ConditionalGetTest(MutedTest):
+    app = staticmethod(etag_app)
+
+    def test_validator_cache(self):
+        cache_path = os.path.join(self.tmpdir, 'validators.json')
+        cache = storytracker.ValidatorCache(cache_path)
+        storytracker.get(self.url, validator_cache=cache)
+        self.assertEqual(cache.get(self.url)['etag'], '"v1"')
+        with self.assertRaises(storytracker.NotModifiedError):
+            storytracker.get(self.url, validator_cache=cache)
+        # It should survive being reopened from disk
+        cache = storytracker.ValidatorCache(cache_path)
+        self.assertEqual(
+            cache.get_headers(self.url),
+            {'If-None-Match': '"v1"'}
+        )
+
+    def test_archive_unchanged(self):
+        cache = storytracker.ValidatorCache(
+            os.path.join(self.tmpdir, 'validators.json')
+        )
+        # A snapshot that can't be saved shouldn't be skipped next time
+        with self.assertRaises(ValueError):
+            storytracker.archive(
+                self.url,
+                output_dir=os.path.join(self.tmpdir, 'missing'),
+                validator_cache=cache
+            )
+        self.assertEqual(cache.get(self.url), None)
+        obj = storytracker.archive(
+            self.url,
+            output_dir=self.tmpdir,
+            validator_cache=cache
+        )
+        self.assertTrue(os.path.exists(obj.gzip_archive_path))
+        obj = storytracker.archive(
+            self.url,
+            output_dir=self.tmpdir,
+            validator_cache=cache
+        )
+        self.assertEqual(obj, None)
+        obj = storytracker.archive(
+            self.url,
+            output_dir=self.tmpdir,
+            validator_cache=cache,
+            unchanged="marker"
+        )
+        self.assertEqual(obj, None)
+        names = os.listdir(self.tmpdir)
+        self.assertEqual(len([n for n in names if n.endswith(".gz")]), 1)
+        self.assertEqual(
+            len([n for n in names if n.endswith(".unchanged")]),
+            1
+        )
+        urlset = storytracker.open_archive_directory(self.tmpdir)
+        self.assertEqual(len(urlset), 1)
+
+
 class AnalysisTest(MutedTest):
 
     def test_open_archive_gzip(self):
@@ -277,6 +1054,280 @@ class AnalysisTest(MutedTest):
             ArchivedURLSet([1, 2, obj])
         with self.assertRaises(ValueError):
             ArchivedURLSet([obj, obj])
+        # Duplicates are found by their contents, not which object they are
+        twin = ArchivedURL(obj.url, obj.timestamp, "foobar")
+        self.assertEqual(obj.fingerprint, twin.fingerprint)
+        self.assertTrue(twin in urlset)
+        self.assertFalse(
+            ArchivedURL(obj.url, obj.timestamp, "barfoo") in urlset
+        )
+        with self.assertRaises(ValueError):
+            urlset.append(twin)
+        # Replacing and deleting items keeps the index in step
+        with self.assertRaises(ValueError):
+            urlset[0] = obj2
+        urlset[0] = ArchivedURL(obj.url, obj.timestamp, "barfoo")
+        self.assertFalse(obj in urlset)
+        urlset.append(twin)
+        del urlset[-1]
+        self.assertFalse(twin in urlset)
+        self.assertEqual(len(urlset), 3)
+
+    def test_hyperlink_table(self):
+        img = Image("http://www.example.com/a.jpg", width=10, height=20)
+        links = [
+            Hyperlink(
+                "http://www.example.com/a/", "A", 0, images=[img],
+                x=5, y=10, width=100, height=20, cell="a1", font_size="16px"
+            ),
+            Hyperlink(
+                "http://www.example.com/b/", None, 1,
+                x=5.5, y=40, cell="a1", font_size="1.2em"
+            ),
+        ]
+        # Neither kind of object carries a __dict__
+        with self.assertRaises(AttributeError):
+            links[0].__dict__
+        with self.assertRaises(AttributeError):
+            img.__dict__
+        self.assertEqual(links[1].domain, "www.example.com")
+        obj = ArchivedURL(self.url, datetime.now(), "foobar")
+        obj._hyperlinks = links
+        with story_classifier(lambda href: False):
+            rows = [h.__csv__() for h in obj.hyperlinks]
+        table = obj.get_hyperlink_table()
+        self.assertTrue(table is obj.hyperlink_table)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(list(table.column("x")), [5, 5.5])
+        self.assertEqual(table.column("cell"), ["a1", "a1"])
+        self.assertEqual(
+            table.column("domain"),
+            ["www.example.com", "www.example.com"]
+        )
+        first, second = table[0], table[-1]
+        self.assertTrue(isinstance(first, Hyperlink))
+        self.assertEqual(first.href, links[0].href)
+        self.assertEqual(first.images, [img])
+        self.assertEqual(first.font_size, "16px")
+        self.assertEqual(first.font_size_px, 16)
+        self.assertEqual(list(table.column("font_size_px"))[0], 16)
+        self.assertEqual(first.area, 2000)
+        self.assertEqual(second.string, None)
+        self.assertEqual(second.width, None)
+        self.assertEqual(second.font_size, "1.2em")
+        self.assertEqual(second.font_size_px, None)
+        self.assertEqual(links[0].font_size_px, 16)
+        self.assertEqual(first.bounding_box, links[0].bounding_box)
+        self.assertEqual(first.__unicode__(), links[0].__unicode__())
+        with self.assertRaises(IndexError):
+            table[2]
+        # The table takes the place of the list of objects
+        self.assertEqual(obj._hyperlinks, [])
+        self.assertEqual(
+            [h.href for h in obj.hyperlinks],
+            [h.href for h in links]
+        )
+        self.assertTrue(obj.hyperlinks[0].table is table)
+        with story_classifier(lambda href: False):
+            self.assertEqual([h.__csv__() for h in obj.hyperlinks], rows)
+        self.assertEqual(
+            obj.get_hyperlink_by_href("http://www.example.com/b/").index,
+            1
+        )
+        # And can be built straight from a generator
+        table = storytracker.HyperlinkTable(h for h in links)
+        self.assertEqual(table.column("href"), [h.href for h in links])
+
+    def test_story_classifier(self):
+        calls = []
+
+        class CountingClassifier(storytracker.StoryClassifier):
+            def guess(self, href):
+                calls.append(href)
+                return href.endswith("story.html")
+
+        path = os.path.join(self.tmpdir, "stories.json")
+        classifier = CountingClassifier(max_size=2, path=path)
+        hrefs = ["http://a.com/story.html", "http://a.com/", "http://b.com/"]
+        self.assertEqual(
+            classifier.classify_hrefs(hrefs + hrefs),
+            [True, False, False, True, False, False]
+        )
+        self.assertEqual(calls, hrefs)
+        # Only the most recent ones stay in memory
+        self.assertEqual(len(classifier), 2)
+        # But the file remembers everything once it is saved
+        classifier.save()
+        classifier = CountingClassifier(path=path)
+        self.assertTrue(classifier.classify(hrefs[0]))
+        self.assertEqual(len(calls), 3)
+        # Hyperlinks all share the default one
+        original = storytracker.get_default_classifier()
+        storytracker.set_default_classifier(classifier)
+        try:
+            obj = ArchivedURL(self.url, datetime.now(), "foobar")
+            obj._hyperlinks = [
+                Hyperlink(h, "", i) for i, h in enumerate(hrefs)
+            ]
+            self.assertEqual(obj.story_links, obj._hyperlinks[:1])
+            self.assertTrue(obj.hyperlinks[0].is_story)
+            self.assertEqual(len(calls), 3)
+        finally:
+            storytracker.set_default_classifier(original)
+
+    def test_href_index(self):
+        now = datetime.now()
+        obj_list = []
+        for i, hrefs in enumerate([["/a/", "/b/", "/a/"], ["/b/"], ["/c/"]]):
+            obj = ArchivedURL(self.url, now + timedelta(hours=i), "foobar")
+            obj._hyperlinks = [
+                Hyperlink(h, "%s %s" % (h, i), j, y=10 * j + i)
+                for j, h in enumerate(hrefs)
+            ]
+            # Skip the browser, since the links are already here
+            obj.analyze = lambda force=False: None
+            obj_list.append(obj)
+        urlset = ArchivedURLSet(obj_list)
+        index = urlset.get_href_index()
+        self.assertTrue(index is urlset.href_index)
+        self.assertEqual(list(index.keys()), ["/a/", "/b/", "/c/"])
+        # Only the first link with an href on each page is indexed
+        self.assertEqual(
+            index["/a/"],
+            [(obj_list[0], obj_list[0]._hyperlinks[0])]
+        )
+        self.assertEqual(
+            [url for url, a in index["/b/"]],
+            obj_list[:2]
+        )
+        with story_classifier(lambda href: False):
+            analyzed = dict((h['href'], h) for h in urlset.hyperlinks)
+        self.assertEqual(analyzed["/b/"]['archived_urls_with_href'], 2)
+        self.assertEqual(analyzed["/b/"]['timedelta'], timedelta(hours=1))
+        self.assertEqual(analyzed["/b/"]['minimum_y'], 1)
+        self.assertEqual(analyzed["/b/"]['maximum_y'], 10)
+        self.assertEqual(analyzed["/a/"]['archived_url_count'], 3)
+        self.assertEqual(analyzed["/a/"]['headline_list'], ["/a/ 0"])
+
+        # New snapshots are added to the totals without redoing the old ones
+        analyzed_urls = []
+        for obj in obj_list:
+            obj.analyze = lambda force=False, o=obj: analyzed_urls.append(o)
+        for i in range(3, 6):
+            obj = ArchivedURL(self.url, now + timedelta(hours=i), "foobar")
+            obj._hyperlinks = [Hyperlink("/b/", "/b/ %s" % i, 0, y=i * i)]
+            obj.analyze = lambda force=False, o=obj: analyzed_urls.append(o)
+            urlset.append(obj)
+            obj_list.append(obj)
+            with story_classifier(lambda href: False):
+                analyzed = dict((h['href'], h) for h in urlset.hyperlinks)
+            self.assertEqual(analyzed_urls, [obj])
+            del analyzed_urls[:]
+        self.assertEqual(len(urlset.href_index["/b/"]), 5)
+        with story_classifier(lambda href: False):
+            rebuilt = dict(
+                (h['href'], h) for h in urlset.get_hyperlinks(force=True)
+            )
+        self.assertEqual(analyzed, rebuilt)
+        self.assertEqual(analyzed["/b/"]['archived_url_count'], 6)
+        self.assertEqual(analyzed["/b/"]['archived_urls_with_href'], 5)
+        self.assertEqual(analyzed["/b/"]['median_y'], 10.0)
+        self.assertEqual(analyzed["/b/"]['average_y'], 61 / 5.0)
+        self.assertEqual(analyzed["/b/"]['range_y'], 24.0)
+        self.assertEqual(analyzed["/b/"]['timedelta'], timedelta(hours=5))
+        # Taking one out starts over
+        del analyzed_urls[:]
+        del urlset[-1]
+        self.assertEqual(len(urlset.href_index["/b/"]), 4)
+        self.assertEqual(analyzed_urls, list(urlset))
+        del analyzed_urls[:]
+        # Looking at the index first doesn't leave the statistics behind
+        obj = ArchivedURL(self.url, now + timedelta(hours=9), "foobar")
+        obj._hyperlinks = [Hyperlink("/d/", "/d/", 0, y=1)]
+        obj.analyze = lambda force=False, o=obj: analyzed_urls.append(o)
+        urlset.append(obj)
+        self.assertEqual(len(urlset.href_index["/d/"]), 1)
+        self.assertEqual(analyzed_urls, [obj])
+        with story_classifier(lambda href: False):
+            analyzed = dict((h['href'], h) for h in urlset.hyperlinks)
+        self.assertEqual(analyzed["/b/"]['archived_url_count'], 6)
+        self.assertEqual(analyzed["/d/"]['archived_urls_with_href'], 1)
+
+    def test_sketches(self):
+        values = [random.gauss(0, 1) for i in range(20000)]
+        digest = storytracker.TDigest()
+        for value in values:
+            digest.add(value)
+        values.sort()
+        for q in (0.01, 0.25, 0.5, 0.75, 0.99):
+            estimate = digest.quantile(q)
+            rank = len([v for v in values if v < estimate]) / 20000.0
+            self.assertTrue(abs(rank - q) < 0.01)
+        self.assertEqual(digest.min, values[0])
+        self.assertEqual(digest.max, values[-1])
+        self.assertTrue(len(digest._centroids) < 1000)
+        other = storytracker.TDigest()
+        other.add(100)
+        digest.merge(other)
+        self.assertEqual(digest.count, 20001)
+        self.assertEqual(digest.max, 100)
+        self.assertEqual(storytracker.TDigest().median, None)
+
+        hll = storytracker.HyperLogLog()
+        for i in range(20000):
+            hll.add("http://www.example.com/%s" % (i % 10000))
+        self.assertTrue(abs(hll.count() - 10000) < 300)
+        other = storytracker.HyperLogLog()
+        for i in range(10000, 20000):
+            other.add("http://www.example.com/%s" % i)
+        hll.merge(other)
+        self.assertTrue(abs(len(hll) - 20000) < 600)
+        with self.assertRaises(ValueError):
+            hll.merge(storytracker.HyperLogLog(precision=10))
+
+    def test_streaming_summary(self):
+        now = datetime.now()
+
+        def iter_objects():
+            for i in range(4):
+                obj = ArchivedURL(
+                    self.url,
+                    now + timedelta(hours=i),
+                    "foobar"
+                )
+                obj._hyperlinks = [
+                    Hyperlink("/%s/story.html" % j, "", j, y=j * 10)
+                    for j in range(i + 1)
+                ] + [Hyperlink("/", "Home", i + 1, y=0)]
+                obj._images = [Image("/logo.png")]
+                yield obj
+
+        summary = storytracker.StreamingSummary()
+        with story_classifier(lambda href: href.endswith("story.html")):
+            summary.extend(iter_objects())
+        stats = summary.summary_statistics
+        self.assertEqual(stats['archived_url_count'], 4)
+        self.assertEqual(stats['earliest_timestamp'], now)
+        self.assertEqual(stats['latest_timestamp'], now + timedelta(hours=3))
+        self.assertEqual(stats['distinct_href_count'], 5)
+        self.assertEqual(stats['distinct_story_href_count'], 4)
+        self.assertEqual(stats['hyperlink_count_average'], 3.5)
+        self.assertEqual(stats['hyperlink_count_median'], 3.5)
+        self.assertEqual(stats['hyperlink_count_range'], 3)
+        self.assertEqual(stats['story_link_count_min'], 1)
+        self.assertEqual(stats['story_link_count_max'], 4)
+        self.assertEqual(stats['image_count_median'], 1)
+        self.assertEqual(stats['story_link_y_max'], 30)
+
+    def test_running_median(self):
+        import calculate
+        values = [random.randint(0, 1000) for i in range(101)]
+        median = storytracker.toolbox.RunningMedian()
+        for i, value in enumerate(values):
+            median.add(value)
+            self.assertEqual(median.median, calculate.median(values[:i + 1]))
+        self.assertEqual(len(median), 101)
+        self.assertEqual(storytracker.toolbox.RunningMedian().median, None)
 
     def test_open_archive_directory(self):
         with self.assertRaises(ValueError):
@@ -294,6 +1345,16 @@ class AnalysisTest(MutedTest):
         urlset = storytracker.open_archive_directory(self.tmpdir)
         self.assertTrue(len(urlset), 2)
         [self.assertTrue(isinstance(o, ArchivedURL)) for o in urlset]
+        # Reading with many threads gives back the same set in the same order
+        storytracker.archive(self.url, output_dir=self.tmpdir)
+        open(os.path.join(self.tmpdir, "notes.txt"), "w").close()
+        threaded = storytracker.open_archive_directory(self.tmpdir, workers=3)
+        self.assertEqual(
+            [(o.url, o.timestamp, o.encoded_html) for o in threaded],
+            [(o.url, o.timestamp, o.encoded_html) for o in
+             storytracker.open_archive_directory(self.tmpdir)]
+        )
+        self.assertEqual(len(threaded), 3)
 
 
 class WaybackMachineTest(MutedTest):